@@ -0,0 +1,237 @@
+# bench.py — reproducible benchmarks for the chat.py / crypter.py hot paths
+#
+#   python bench.py                      # all benchmarks, table on stdout
+#   python bench.py --json out.json      # also write machine-readable results
+#   python bench.py sync unique_sid      # only these
+#
+# Everything runs in-process against fakediscord, so results only move when
+# our code does. Compare two JSON files with --compare old.json to flag
+# regressions beyond --tolerance.
+
+import argparse, asyncio, contextlib, json, platform, random, statistics, sys, time
+from typing import Callable, Dict, List
+
+import fakediscord
+
+world = fakediscord.install(rate_limit=None, hook_rate_limit=None)
+import chat, crypter
+
+BENCHES: Dict[str, Callable[[argparse.Namespace], Dict]] = {}
+
+
+def bench(name: str):
+    def register(fn):
+        BENCHES[name] = fn
+        return fn
+    return register
+
+
+def _reset() -> None:
+    for table in (chat.session_message_ids, chat.session_counts, chat.session_last_seen,
+                  chat.receive_handlers, chat.session_shards, chat.counter_writers,
+                  crypter.session_passwords, crypter.session_keys):
+        table.clear()
+    for sid in list(chat.session_channel_ids): chat._unbind_channel(sid)
+    for shard in chat.shards: shard.sids.clear(); shard.high_water = None
+    for g in world.bot.guilds:
+        g.text_channels[:] = [c for c in g.text_channels if c.id in chat.shard_by_channel]
+        for c in g.text_channels: c.messages.clear()
+    chat.stale_counts.clear(); chat.state_dirty.clear()
+    crypter.key_cache.clear()
+    random.seed(1234)
+
+
+def _timed(fn: Callable[[], object], repeat: int) -> List[float]:
+    runs = []
+    for _ in range(repeat):
+        t = time.perf_counter(); fn(); runs.append(time.perf_counter() - t)
+    return runs
+
+
+def _arun(make_coro: Callable[[], object]) -> float:
+    """Run one coroutine on a fresh loop that chat.bot believes is its own."""
+    async def main():
+        world.bot.loop = asyncio.get_running_loop()
+        t = time.perf_counter(); await make_coro(); elapsed = time.perf_counter() - t
+        for http in (chat.http_session, chat.hook_http):
+            if http is not None: await http.close()
+        return elapsed
+    try: return asyncio.run(main())
+    finally:
+        for shard in chat.shards: shard.sync_lock = asyncio.Lock()
+        chat.inbound_queues.clear(); chat.inbound_tasks.clear()
+        chat.outbound_locks.clear(); chat.outbound_senders.clear(); chat.channel_hooks.clear()
+        chat.http_session = chat.hook_http = None
+
+
+def _result(ops: int, runs: List[float], **extra) -> Dict:
+    best = min(runs)
+    return {"ops": ops, "runs": runs, "best_s": best, "median_s": statistics.median(runs),
+            "ops_per_s": ops / best if best else 0.0, **extra}
+
+
+# ───────────────────────── crypto ───────────────────────────────────────
+@bench("crypto_legacy")
+def _crypto_legacy(args) -> Dict:
+    """encrypt_message + decrypt_message: a fresh salt means PBKDF2 on both sides."""
+    _reset()
+    n = max(1, args.n // 100)
+    plain = "user:" + "x" * 64
+    runs = _timed(lambda: [crypter.decrypt_message(crypter.encrypt_message(plain, "pw"), "pw")
+                           for _ in range(n)], args.repeat)
+    return _result(n, runs)
+
+
+@bench("crypto_session")
+def _crypto_session(args) -> Dict:
+    """encode/decode_session_message round trips, per wire version."""
+    _reset()
+    crypter.init_session("000001", "pw")
+    plain = "user:" + "x" * 64
+    out = {}
+    for version in (1, crypter.WIRE_V2):
+        runs = _timed(lambda: [crypter.decode_session_message(
+            "000001", crypter.encode_session_message("000001", plain, version))
+            for _ in range(args.n)], args.repeat)
+        out[f"v{version}"] = _result(args.n, runs,
+                                     wire_bytes=len(crypter.encode_session_message("000001", plain, version)))
+    best = out[f"v{crypter.WIRE_V2}"]
+    return {**best, "versions": out}
+
+
+# ───────────────────────── routing ──────────────────────────────────────
+@bench("on_message")
+def _on_message(args) -> Dict:
+    """Gateway messages across many session channels → decrypted → handlers."""
+    runs, total = [], 0
+    for _ in range(args.repeat):
+        _reset()
+        guild, channels = world.bot.guilds[0], []
+        for i in range(args.sessions):
+            sid = f"{i:06d}"
+            ch = guild.add_channel(sid)
+            crypter.init_session(sid, "pw"); chat._bind_channel(sid, ch.id)
+            channels.append((sid, ch))
+        per = max(1, args.n // args.sessions)
+        total = per * len(channels)
+        msgs = [fakediscord.FakeMessage(world, ch, crypter.encode_session_message(sid, f"u:{k}"),
+                                        world.bot.user)
+                for k in range(per) for sid, ch in channels]
+
+        async def run():
+            done, seen = asyncio.Event(), [0]
+            def received(_):
+                seen[0] += 1
+                if seen[0] == total: done.set()
+            for sid, _ in channels: chat.register_receive_callback(sid, received)
+            for m in msgs:
+                await chat.on_message(m)
+                await asyncio.sleep(0)              # one gateway event per loop turn
+            await done.wait()
+        runs.append(_arun(run))
+    return _result(total, runs, sessions=args.sessions)
+
+
+# ───────────────────────── counters ─────────────────────────────────────
+@bench("update_count")
+def _update_count(args) -> Dict:
+    """Concurrent join/leave bursts on many sessions through the debounced writer."""
+    runs, requested, written = [], 0, 0
+    joins = max(1, args.n // (10 * args.sessions))
+    for _ in range(args.repeat):
+        _reset()
+        chat.counter_stats.update(requested=0, written=0)
+
+        async def run():
+            sids = [f"{i:06d}" for i in range(args.sessions)]
+            shard = chat.shards[0]
+            for sid in sids: await chat._start_session(sid, shard)
+            ops = [chat._update_count(sid, d) for sid in sids for d in (+1, -1) * joins]
+            random.shuffle(ops)
+            await asyncio.gather(*ops)
+        runs.append(_arun(run))
+        requested, written = chat.counter_stats["requested"], chat.counter_stats["written"]
+    return _result(requested, runs, sessions=args.sessions, counter_writes=written,
+                   debounce_s=chat.COUNTER_DEBOUNCE)
+
+
+# ───────────────────────── session sync ─────────────────────────────────
+@bench("sync")
+def _sync(args) -> Dict:
+    """sync_active_sessions: full rescan of a large history, then an incremental pass."""
+    _reset()
+    shard = chat.shards[0]
+    chan  = world.bot.get_channel(shard.sessions_channel_id)
+    hook  = world.hooks[shard.webhook_url]
+    for i in range(args.history):
+        chan.messages.append(fakediscord.FakeMessage(world, chan, f"{i:06d}|{1 + i % 4}",
+                                                     webhook_id=hook.id))
+    full, delta = [], []
+    for _ in range(args.repeat):
+        before = dict(world.calls)
+        full.append(_arun(lambda: chat.sync_active_sessions(full=True)))
+        delta.append(_arun(chat.sync_active_sessions))
+        pages = world.calls.get("history", 0) - before.get("history", 0)
+    return _result(args.history, full, incremental=_result(0, delta),
+                   sessions=len(chat.session_counts), history_requests=pages)
+
+
+@bench("unique_sid")
+def _unique_sid(args) -> Dict:
+    """_unique_sid with a crowded guild (near the channel cap, many live sessions)."""
+    _reset()
+    guild = world.bot.guilds[0]
+    for i in range(chat.GUILD_CHANNEL_CAP - 1):
+        sid = f"{random.randint(0, 999_999):06d}"
+        chat._bind_channel(sid, guild.add_channel(sid).id); chat.session_counts[sid] = 1
+    runs = _timed(lambda: [chat._unique_sid() for _ in range(args.n)], args.repeat)
+    return _result(args.n, runs, channels=len(guild.text_channels))
+
+
+# ───────────────────────── driver ───────────────────────────────────────
+def compare(old: Dict, new: Dict, tolerance: float) -> List[str]:
+    """Benchmarks whose best time got worse than <tolerance> (0.2 = 20 %)."""
+    slower = []
+    for name, res in new["results"].items():
+        prev = old.get("results", {}).get(name)
+        if prev and prev["best_s"] and res["best_s"] > prev["best_s"] * (1 + tolerance):
+            slower.append(f"{name}: {prev['best_s'] * 1000:.2f}ms → {res['best_s'] * 1000:.2f}ms")
+    return slower
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="StealthChat benchmarks")
+    p.add_argument("names", nargs="*", help=f"subset of: {', '.join(BENCHES)}")
+    p.add_argument("-n", type=int, default=2000, help="operations per benchmark run")
+    p.add_argument("--repeat", type=int, default=3, help="runs per benchmark (best is kept)")
+    p.add_argument("--sessions", type=int, default=50, help="sessions for routing/counter benches")
+    p.add_argument("--history", type=int, default=5000, help="counter messages for the sync bench")
+    p.add_argument("--json", metavar="PATH", help="write results as JSON ('-' for stdout)")
+    p.add_argument("--compare", metavar="PATH", help="baseline JSON to check for regressions")
+    p.add_argument("--tolerance", type=float, default=0.2)
+    args = p.parse_args(argv)
+    unknown = set(args.names) - set(BENCHES)
+    if unknown: p.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    report = {"python": platform.python_version(), "platform": platform.platform(),
+              "params": {k: v for k, v in vars(args).items() if k not in ("names", "json", "compare")},
+              "results": {}}
+    for name in args.names or BENCHES:
+        with contextlib.redirect_stdout(sys.stderr):     # keep chat's logging out of the report
+            res = report["results"][name] = BENCHES[name](args)
+        if args.json != "-":
+            print(f"{name:<16} {res['ops']:>7} ops  best {res['best_s'] * 1000:9.2f} ms"
+                  f"  {res['ops_per_s']:>12,.0f} ops/s")
+
+    if args.json == "-": json.dump(report, sys.stdout, indent=2); print()
+    elif args.json:
+        with open(args.json, "w") as f: json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f: slower = compare(json.load(f), report, args.tolerance)
+        for line in slower: print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,21 +1,61 @@
 # chat.py — StealthChat backend (final user-count model)
 
-import os, asyncio, random, base64, aiohttp
+import os, asyncio, heapq, random, hashlib, re, tempfile, threading, time, aiohttp
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Callable, Dict, List, Optional
+from typing import Awaitable, BinaryIO, Callable, Deque, Dict, List, Optional, Tuple, TypeVar
 
 import discord
 from discord.ext import commands, tasks
 from discord import Webhook
 from dotenv import load_dotenv
 
-import crypter
+import crypter, metrics, snapshot
 
 # ─── env ────────────────────────────────────────────────────────────────
 load_dotenv()
 BOT_TOKEN           = os.environ["BOT_TOKEN"]
-WEBHOOK_URL         = os.environ["WEBHOOK_URL"]          # webhook that posts to SESSIONS_CHANNEL_ID
-SESSIONS_CHANNEL_ID = int(os.environ["SESSIONS_CHANNEL_ID"])
+# SHARDS="<guild id>,<sessions channel id>,<webhook url>;…" spreads sessions over
+# several guilds; without it the single-guild WEBHOOK_URL/SESSIONS_CHANNEL_ID pair is used
+SHARDS_SPEC         = os.environ.get("SHARDS", "").strip()
+SHARD_MAX_SESSIONS  = int(os.environ.get("SHARD_MAX_SESSIONS", "450"))  # per guild
+GUILD_CHANNEL_CAP   = 500
+CRYPTO_POOL         = os.environ.get("CRYPTO_POOL", "thread")      # "thread" | "process"
+CRYPTO_WORKERS      = int(os.environ.get("CRYPTO_WORKERS", "4"))
+INBOUND_QUEUE_SIZE  = int(os.environ.get("INBOUND_QUEUE_SIZE", "64"))  # per-session backlog, then drops
+INBOUND_INFLIGHT    = int(os.environ.get("INBOUND_INFLIGHT", "2"))     # decrypts one session may have queued in the pool
+COUNTER_DEBOUNCE    = float(os.environ.get("COUNTER_DEBOUNCE", "0.25"))  # s to merge join/leave bursts
+SEND_RATE           = int(os.environ.get("SEND_RATE", "5"))        # messages per channel …
+SEND_WINDOW         = float(os.environ.get("SEND_WINDOW", "5"))    # … per this many seconds
+SEND_VIA_WEBHOOK    = os.environ.get("SEND_VIA_WEBHOOK", "1") == "1"  # add a per-channel webhook lane
+HOOK_SEND_RATE      = int(os.environ.get("HOOK_SEND_RATE", "30"))     # webhook messages per channel …
+HOOK_SEND_WINDOW    = float(os.environ.get("HOOK_SEND_WINDOW", "60")) # … per this many seconds
+HOOK_NAME           = "stealthchat"
+HOOK_RECHECK        = 30.0    # s before an unknown webhook id makes us re-list a channel's hooks
+PACK_MESSAGES       = os.environ.get("PACK_MESSAGES", "1") == "1"  # several payloads per message
+MAX_MESSAGE_LEN     = 2000
+CHANNEL_POOL_SIZE   = int(os.environ.get("CHANNEL_POOL_SIZE", "0"))  # pre-created spare channels (0 = off)
+POOL_LEASE          = float(os.environ.get("POOL_LEASE", "3600"))   # s a spare stays reserved for its creator
+POOL_TAG            = os.environ.get("POOL_TAG") or f"{random.randint(0, 0xFFFFFF):06x}"  # 6 hex digits
+RENAME_COOLDOWN     = 600.0
+WIRE_VERSION        = int(os.environ.get("WIRE_VERSION", str(crypter.WIRE_V2)))  # 1 = base64 Fernet
+MAX_IMAGE_BYTES     = int(os.environ.get("MAX_IMAGE_BYTES", str(8 * 1024 * 1024)))
+BLOB_CACHE_BYTES    = int(os.environ.get("BLOB_CACHE_BYTES", str(64 * 1024 * 1024)))
+IDLE_TIMEOUT        = float(os.environ.get("IDLE_TIMEOUT", "1800"))  # s without payloads → session ends
+EXPIRY_CONCURRENCY  = int(os.environ.get("EXPIRY_CONCURRENCY", "4"))  # idle teardowns in flight
+DECRYPT_FAIL_LIMIT  = int(os.environ.get("DECRYPT_FAIL_LIMIT", "20"))     # failed decrypts in one session …
+DECRYPT_FAIL_WINDOW = float(os.environ.get("DECRYPT_FAIL_WINDOW", "60"))  # … per s, then PBKDF2 payloads are shed
+HISTORY_PAGE        = int(os.environ.get("HISTORY_PAGE", "25"))       # payloads decrypted per history page
+HISTORY_HORIZON     = float(os.environ.get("HISTORY_HORIZON", "600")) # s of backlog replayed (GUI line TTL)
+STATE_DB            = os.environ.get("STATE_DB", "stealthchat_state.db")  # "" = no snapshot
+STATE_FLUSH         = float(os.environ.get("STATE_FLUSH", "2"))    # s between journal writes
+SNAPSHOT_MAX_AGE    = timedelta(hours=6)  # older snapshots are ignored: full rescan instead
+METRICS_PORT        = int(os.environ.get("METRICS_PORT", "0"))    # /metrics endpoint (0 = off)
+METRICS_HOST        = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PROFILE     = os.environ.get("METRICS_PROFILE", "0") == "1"  # POST /profile/start|stop
+METRICS_DUMP        = os.environ.get("METRICS_DUMP", "")           # periodic JSON snapshot path
+METRICS_DUMP_EVERY  = float(os.environ.get("METRICS_DUMP_EVERY", "60"))
 
 # ─── discord client ─────────────────────────────────────────────────────
 intents                 = discord.Intents.default()
@@ -23,53 +63,167 @@ intents.guilds          = True
 intents.messages        = True
 intents.message_content = True
 bot                      = commands.Bot(command_prefix="!", intents=intents)
+ready                    = threading.Event()  # set once on_ready has synced sessions
+
+# ─── shards ─────────────────────────────────────────────────────────────
+class Shard:
+    """One guild's slice of capacity: sessions channel, counter webhook, spare
+    channels and sync position, each tracked independently of other shards."""
+
+    def __init__(self, guild_id: int, sessions_channel_id: int, webhook_url: str):
+        self.guild_id            = guild_id      # 0 → resolved from the channel on ready
+        self.sessions_channel_id = sessions_channel_id
+        self.webhook_url         = webhook_url
+        self.sids:  set          = set()         # sessions placed on this shard
+        self.pool:  Deque[Tuple[int, float, float]] = deque()  # (channel id, claimable-at loop time, lease end)
+        self.high_water: Optional[int] = None    # newest counter-message id seen
+        self.sync_lock  = asyncio.Lock()
+        self.rate_limited = 0                    # 429s seen on this guild's channels
+
+    def guild(self) -> Optional[discord.Guild]:
+        return bot.get_guild(self.guild_id)
+
+    def free_slots(self) -> int:
+        guild = self.guild()
+        if guild is None: return 0
+        return min(SHARD_MAX_SESSIONS - len(self.sids),
+                   GUILD_CHANNEL_CAP - len(guild.channels) + len(self.pool))
+
+def _parse_shards() -> List[Shard]:
+    if not SHARDS_SPEC:
+        return [Shard(int(os.environ.get("GUILD_ID", "0")),
+                      int(os.environ["SESSIONS_CHANNEL_ID"]), os.environ["WEBHOOK_URL"])]
+    out = []
+    for part in filter(None, (p.strip() for p in SHARDS_SPEC.split(";"))):
+        gid, chan, hook = part.split(",", 2)
+        out.append(Shard(int(gid), int(chan), hook.strip()))
+    return out
 
 # ─── runtime state ──────────────────────────────────────────────────────
 session_message_ids: Dict[str, int]              = {}  # SID → counter-message id
 session_channel_ids: Dict[str, int]              = {}  # SID → text-channel id
+channel_sessions:    Dict[int, str]              = {}  # text-channel id → SID (reverse index)
 session_counts:      Dict[str, int]              = {}  # SID → cached live count
-session_last_seen:   Dict[str, datetime]         = {}  # SID → last payload time
+session_last_seen:   Dict[str, datetime]         = {}  # SID → last payload seen in its channel
 receive_handlers:    Dict[str, List[Callable[[str], None]]] = {}
+shards:              List[Shard]                 = _parse_shards()
+shard_by_channel:    Dict[int, Shard]            = {s.sessions_channel_id: s for s in shards}
+session_shards:      Dict[str, Shard]            = {}  # SID → shard holding its counter
 
-http_session: Optional[aiohttp.ClientSession] = None
+http_session: Optional[aiohttp.ClientSession] = None  # counter webhooks, attachment downloads
+hook_http:    Optional[aiohttp.ClientSession] = None  # session-channel webhooks (chat sends)
+crypto_pool:  Optional[Executor]              = None
+inbound_queues:  Dict[str, "asyncio.Queue[Tuple[str, Optional[str]]]"] = {}  # SID → payloads awaiting decrypt
+decrypt_failures: Dict[str, Deque[float]]     = {}  # SID → recent failed decrypts (monotonic)
+inbound_tasks:   Dict[str, asyncio.Task]      = {}  # SID → in-order dispatcher
+outbound_locks:  Dict[str, asyncio.Lock]      = {}  # SID → keeps sends in submit order
+counter_writers: Dict[str, "_CounterWriter"]  = {}  # SID → debounced counter writer
+counter_stats:   Dict[str, int]               = {"requested": 0, "written": 0}
+outbound_senders: Dict[int, "_ChannelSender"] = {}  # channel id → send queue
+channel_hooks:   Dict[int, "_HookSet"]        = {}  # channel id → the bot's webhooks there
+send_stats:      Dict[str, int]               = {"messages": 0, "payloads": 0, "rate_limited": 0,
+                                                  "via_webhook": 0}
+pool_wanted = asyncio.Event()
+pool_task:       Optional[asyncio.Task]       = None
+blob_tasks:      Dict[str, asyncio.Task]      = {}  # content hash → attachment download
+state_store:     Optional[snapshot.StateStore] = snapshot.StateStore(STATE_DB) if STATE_DB else None
+state_dirty:     set                          = set()  # SIDs changed since the last flush
+state_marks:     Dict[int, int]               = {}     # high-water marks last journaled
+stale_counts:    set                          = set()  # restored counts not yet re-read
+state_restored = False
+metrics_runner = None
 
 # ────────────────────────── helpers ─────────────────────────────────────
-async def _get_hook() -> Webhook:
+def _get_http() -> aiohttp.ClientSession:
     global http_session
     if http_session is None or http_session.closed:
         http_session = aiohttp.ClientSession()
-    return Webhook.from_url(WEBHOOK_URL, session=http_session)
+    return http_session
+
+def _get_hook_http() -> aiohttp.ClientSession:
+    global hook_http
+    if hook_http is None or hook_http.closed:
+        hook_http = aiohttp.ClientSession()
+    return hook_http
+
+T = TypeVar("T")
+
+async def _api(op: str, aw: Awaitable[T]) -> T:
+    """Await one Discord request, recording its latency and outcome under <op>."""
+    t = time.perf_counter()
+    try:
+        return await aw
+    except discord.HTTPException as e:
+        metrics.inc("discord_api_errors_total", op=op, status=e.status); raise
+    finally:
+        metrics.observe("discord_api_seconds", time.perf_counter() - t, op=op)
+
+async def _get_hook(shard: Shard) -> Webhook:
+    return Webhook.from_url(shard.webhook_url, session=_get_http())
 
-def _unique_sid(guild: discord.Guild) -> str:
-    existing = {c.name for c in guild.channels}
+def _shard_of(sid: str) -> Shard:
+    return session_shards.get(sid) or shards[0]
+
+def _place_session(sid: str, shard: Shard) -> None:
+    old = session_shards.get(sid)
+    if old is not None and old is not shard: old.sids.discard(sid)
+    session_shards[sid] = shard
+    shard.sids.add(sid)
+    state_dirty.add(sid)
+
+def _pick_shard() -> Shard:
+    """Least-loaded shard that still has room for a session channel."""
+    best = max(shards, key=lambda s: s.free_slots())
+    if best.free_slots() <= 0: raise RuntimeError("every shard is at capacity")
+    return best
+
+def _unique_sid() -> str:
+    # session channels are named after their sid and are all tracked locally,
+    # so there's no need to collect every channel name in the guild
     while True:
         sid = f"{random.randint(0, 999_999):06d}"
-        if sid not in existing and sid not in session_channel_ids:
+        if sid not in session_channel_ids and sid not in session_counts:
             return sid
 
+def _bind_channel(sid: str, ch_id: int) -> None:
+    old = session_channel_ids.get(sid)
+    if old is not None: channel_sessions.pop(old, None)
+    session_channel_ids[sid] = ch_id
+    channel_sessions[ch_id]  = sid
+    state_dirty.add(sid)
+
+def _unbind_channel(sid: str) -> Optional[int]:
+    ch_id = session_channel_ids.pop(sid, None)
+    state_dirty.add(sid)
+    if ch_id is not None:
+        channel_sessions.pop(ch_id, None)
+        outbound_senders.pop(ch_id, None)       # bucket state dies with the channel
+    return ch_id
+
 # ───────────────────────── counter-message ops ──────────────────────────
 async def _post_session_message(sid: str, count: int) -> int:
-    hook = await _get_hook()
-    msg  = await hook.send(content=f"{sid}|{count}", wait=True)
+    hook = await _get_hook(_shard_of(sid))
+    msg  = await _api("webhook.send", hook.send(content=f"{sid}|{count}", wait=True))
     return msg.id
 
 async def _locate_counter_message(sid: str) -> Optional[discord.Message]:
     """Return the WebhookMessage object for <sid>|<n>, resyncing cache if needed."""
-    hook = await _get_hook()
+    shard = _shard_of(sid)
+    hook  = await _get_hook(shard)
     # fast path: cached id
     msg_id = session_message_ids.get(sid)
     if msg_id:
         try:
-            return await hook.fetch_message(msg_id)
+            return await _api("webhook.fetch", hook.fetch_message(msg_id))
         except discord.NotFound:
             pass
     # slow path: scan recent history once
-    chan = bot.get_channel(SESSIONS_CHANNEL_ID) or await bot.fetch_channel(SESSIONS_CHANNEL_ID)
-    if not isinstance(chan, discord.TextChannel):
+    chan = await _sessions_channel(shard)
+    if chan is None:
         return None
     async for m in chan.history(limit=100):
         if m.webhook_id and m.content.startswith(f"{sid}|"):
-            session_message_ids[sid] = m.id
+            session_message_ids[sid] = m.id; state_dirty.add(sid)
             return m
     return None
 
@@ -84,79 +238,310 @@ async def _get_live_count(sid: str) -> Optional[int]:
         return None
 
 async def _edit_or_create_counter(sid: str, new_total: int) -> None:
-    hook = await _get_hook()
+    hook = await _get_hook(_shard_of(sid))
+    msg_id = session_message_ids.get(sid)
+    if msg_id:                              # fast path: edit blind by cached id
+        try:
+            await _api("webhook.edit", hook.edit_message(message_id=msg_id,
+                                                         content=f"{sid}|{new_total}"))
+            return
+        except discord.NotFound:
+            session_message_ids.pop(sid, None)
     msg  = await _locate_counter_message(sid)
     if msg:
-        await hook.edit_message(message_id=msg.id,
-                                content=f"{sid}|{new_total}")
+        await _api("webhook.edit", hook.edit_message(message_id=msg.id,
+                                                     content=f"{sid}|{new_total}"))
     else:
         session_message_ids[sid] = await _post_session_message(sid, new_total)
+        state_dirty.add(sid)
 
 async def _delete_session_message(sid: str) -> None:
-    hook = await _get_hook()
+    hook = await _get_hook(_shard_of(sid))
     msg_id = session_message_ids.pop(sid, None)
     if msg_id:
         try:
-            await hook.delete_message(msg_id)
+            await _api("webhook.delete", hook.delete_message(msg_id))
         except discord.NotFound:
             pass
 
+# ───────────────────────── channel pool ─────────────────────────────────
+# Unclaimed channels are named "pool-<tag>-<lease end as hex unix time>". Only
+# this process's tag is ever claimed, so two clients never race for a channel.
+# Once a lease (plus POOL_GRACE) has run out, any bot may delete the spare, so
+# channels left by crashed or killed processes don't pile up against the cap.
+POOL_GRACE = 60.0
+# <tag> is 6 hex digits; spares named before leases carry a 6-digit random
+# suffix instead, which reads as a long-expired lease
+POOL_NAME  = re.compile(r"pool-[0-9a-f]{6}-([0-9a-f]{6,8})")
+if not re.fullmatch(r"[0-9a-f]{6}", POOL_TAG):
+    raise ValueError(f"POOL_TAG must be 6 lowercase hex digits, got {POOL_TAG!r}")
+
+def _pool_name() -> str:
+    return f"pool-{POOL_TAG}-{int(time.time() + POOL_LEASE):x}"
+
+def _pool_lease(name: str) -> Optional[float]:
+    """Lease end (unix time) encoded in a spare's name; None if it isn't one."""
+    m = POOL_NAME.fullmatch(name)
+    return float(int(m.group(1), 16)) if m else None
+
+def _adopt_pool_channels(shard: Shard) -> None:
+    guild = shard.guild()
+    if guild is None: return
+    prefix = f"pool-{POOL_TAG}-"
+    known  = {entry[0] for entry in shard.pool}
+    for ch in guild.text_channels:
+        lease = _pool_lease(ch.name)
+        if ch.name.startswith(prefix) and ch.id not in known and lease and lease > time.time():
+            shard.pool.append((ch.id, 0.0, lease))
+
+def _claim_pool_channel(shard: Shard) -> Optional[discord.TextChannel]:
+    guild = shard.guild()
+    if guild is None: return None
+    now = asyncio.get_running_loop().time()
+    for entry in list(shard.pool):
+        if entry[1] > now: continue            # still in its rename cooldown
+        if entry[2] <= time.time(): continue   # lease ran out: the reaper deletes it
+        shard.pool.remove(entry)
+        ch = guild.get_channel(entry[0])
+        if isinstance(ch, discord.TextChannel):
+            return ch
+    return None
+
+async def _release_to_pool(shard: Shard, ch: discord.TextChannel) -> bool:
+    """Wipe and park a finished session channel for reuse; False if the pool is full."""
+    if len(shard.pool) >= CHANNEL_POOL_SIZE: return False
+    name = _pool_name()
+    try:
+        await _api("channel.purge", ch.purge(limit=None))
+        await _api("channel.rename", ch.edit(name=name))
+    except discord.HTTPException:
+        return False
+    # Discord allows two renames per channel per 10 minutes: park it until the
+    # claim rename can't be throttled
+    shard.pool.append((ch.id, asyncio.get_running_loop().time() + RENAME_COOLDOWN,
+                       _pool_lease(name) or 0.0))
+    return True
+
+async def _reap_pool_channels(shard: Shard) -> None:
+    """Delete spares past their lease: ours right away, anyone's after POOL_GRACE."""
+    guild = shard.guild()
+    if guild is None: return
+    now  = time.time()
+    mine = {entry[0]: entry for entry in shard.pool}
+    for ch in list(guild.text_channels):
+        lease = _pool_lease(ch.name)
+        if lease is None or lease + (0.0 if ch.id in mine else POOL_GRACE) > now: continue
+        if ch.id in mine: shard.pool.remove(mine[ch.id])
+        try: await _api("channel.delete", ch.delete())
+        except discord.HTTPException: pass      # another bot got there first
+
+async def _pool_manager() -> None:
+    """Background refill: keep CHANNEL_POOL_SIZE unclaimed, leased channels per shard."""
+    while True:
+        try: await asyncio.wait_for(pool_wanted.wait(), POOL_LEASE / 4)
+        except asyncio.TimeoutError: pass       # time to replace spares whose lease ran out
+        pool_wanted.clear()
+        for shard in shards:
+            guild = shard.guild()
+            if guild is None: continue
+            await _reap_pool_channels(shard)
+            while len(shard.pool) < CHANNEL_POOL_SIZE:
+                name = _pool_name()
+                try: ch = await _api("channel.create", guild.create_text_channel(name))
+                except discord.HTTPException as e:
+                    print(f"[POOL] refill failed in {guild.id}: {e}"); break
+                shard.pool.append((ch.id, 0.0, _pool_lease(name) or 0.0))
+                if SEND_VIA_WEBHOOK: await _channel_hooks(ch)   # ready before it's claimed
+
+async def drain_channel_pool() -> None:
+    """Delete this process's unclaimed channels (on shutdown)."""
+    for shard in shards:
+        while shard.pool:
+            ch = bot.get_channel(shard.pool.popleft()[0])
+            if isinstance(ch, discord.TextChannel):
+                try: await _api("channel.delete", ch.delete())
+                except discord.HTTPException: pass
+
 # ───────────────────────── channel ops ──────────────────────────────────
-async def _create_session_channel(sid: str, guild: discord.Guild) -> int:
-    ch = await guild.create_text_channel(sid)
+async def _create_session_channel(sid: str, shard: Shard) -> int:
+    ch = _claim_pool_channel(shard) if CHANNEL_POOL_SIZE else None
+    pool_wanted.set()
+    if ch is not None:
+        await _api("channel.rename", ch.edit(name=sid))
+        return ch.id
+    guild = shard.guild()
+    if guild is None: raise LookupError(f"bot is not in guild {shard.guild_id}")
+    ch = await _api("channel.create", guild.create_text_channel(sid))
     return ch.id
 
 async def _delete_session_channel(sid: str) -> None:
-    ch_id = session_channel_ids.pop(sid, None)
+    shard = _shard_of(sid)
+    ch_id = _unbind_channel(sid)
     if ch_id:
-        guild = bot.guilds[0]
-        ch = guild.get_channel(ch_id)
+        ch = bot.get_channel(ch_id)
         if isinstance(ch, discord.TextChannel):
-            try: await ch.delete()
+            if await _release_to_pool(shard, ch): return
+            try: await _api("channel.delete", ch.delete())
             except discord.NotFound: pass
 
 # ───────────────────────── lifecycle helpers ────────────────────────────
-async def _start_session(sid: str, guild: discord.Guild) -> None:
-    ch_id = await _create_session_channel(sid, guild)
-    session_channel_ids[sid] = ch_id
-    msg_id = await _post_session_message(sid, 1)
+async def _start_session(sid: str, shard: Shard) -> None:
+    _place_session(sid, shard)
+    # claim/create the channel and post the counter concurrently
+    try:
+        ch_id, msg_id = await asyncio.gather(_create_session_channel(sid, shard),
+                                             _post_session_message(sid, 1),
+                                             return_exceptions=True)
+    except BaseException:                       # cancelled along with the caller
+        _drop_session_state(sid); raise
+    failed = [r for r in (ch_id, msg_id) if isinstance(r, BaseException)]
+    if failed:
+        # undo whichever half reached Discord so no counter or channel is orphaned
+        if not isinstance(ch_id, BaseException):  _bind_channel(sid, ch_id)
+        if not isinstance(msg_id, BaseException): session_message_ids[sid] = msg_id
+        try: await asyncio.gather(_delete_session_channel(sid), _delete_session_message(sid))
+        except Exception as e: print(f"[COUNT] {sid}: start rollback failed: {e}")
+        _drop_session_state(sid)
+        raise failed[0]
+    _bind_channel(sid, ch_id)
     session_message_ids[sid] = msg_id
     session_counts[sid]      = 1
     session_last_seen[sid]   = datetime.now(timezone.utc)
+    idle_expiry.watch(sid)
 
-async def _update_count(sid: str, delta: int) -> None:
-    """Add +1 or -1 to live count; delete channel & message when hits 0."""
-    live = await _get_live_count(sid)
-    if live is None:
-        live = 0
+async def _write_count(sid: str, delta: int) -> None:
+    """Apply a merged delta to the live count; delete channel & message at 0."""
+    live = None if sid in stale_counts else session_counts.get(sid)
+    if live is None:                        # unknown or restored → ask Discord once
+        stale_counts.discard(sid)
+        live = await _get_live_count(sid) or session_counts.get(sid, 0)
     new_total = live + delta
     print(f"[COUNT] {sid}: {live} → {new_total}")
     if new_total <= 0:
         await _delete_session_channel(sid)
         await _delete_session_message(sid)
         crypter.clear_session(sid)
-        session_counts.pop(sid, None)
-        session_last_seen.pop(sid, None)
+        _drop_session_state(sid)
         receive_handlers.pop(sid, None)
+        _close_inbound(sid)
+        metrics.drop(session=sid)
         return
+    session_counts[sid] = new_total; state_dirty.add(sid)
     await _edit_or_create_counter(sid, new_total)
-    session_counts[sid] = new_total
+
+class _CounterWriter:
+    """Serializes one session's count updates, merging bursts into one write."""
+
+    def __init__(self, sid: str):
+        self.sid     = sid
+        self.pending = 0
+        self.waiters: List[asyncio.Future] = []
+        self.task:    Optional[asyncio.Task] = None
+
+    def add(self, delta: int) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self.pending += delta
+        self.waiters.append(fut)
+        counter_stats["requested"] += 1
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        return fut
+
+    async def _run(self) -> None:
+        while self.waiters:
+            await asyncio.sleep(COUNTER_DEBOUNCE)         # let the burst pile up
+            delta, self.pending = self.pending, 0
+            waiters, self.waiters = self.waiters, []
+            try:
+                if delta: await _write_count(self.sid, delta); counter_stats["written"] += 1
+            except Exception as e:
+                for w in waiters:
+                    if not w.done(): w.set_exception(e)
+                continue
+            for w in waiters:
+                if not w.done(): w.set_result(None)
+        if counter_writers.get(self.sid) is self:
+            del counter_writers[self.sid]
+
+def counter_calls_saved() -> int:
+    """Counter writes avoided by merging join/leave bursts."""
+    return counter_stats["requested"] - counter_stats["written"]
+
+async def _update_count(sid: str, delta: int) -> None:
+    """Add +1 or -1 to live count; returns once the merged write has landed."""
+    writer = counter_writers.get(sid)
+    if writer is None:
+        writer = counter_writers[sid] = _CounterWriter(sid)
+    await writer.add(delta)
 
 # ───────────────────────── API for GUI threads ──────────────────────────
-def start_auto_session_from_thread(guild_id: int) -> str:
-    guild = bot.get_guild(guild_id); assert guild
-    sid = _unique_sid(guild)
-    asyncio.run_coroutine_threadsafe(_start_session(sid, guild), bot.loop).result()
+# The *_async variants return concurrent futures immediately so a UI thread
+# never waits on Discord; the *_from_thread variants block on them.
+async def _start_auto_session(guild_id: Optional[int] = None) -> str:
+    """Start a session on the least-loaded shard (or the one for <guild_id>)."""
+    if guild_id is None:
+        shard = _pick_shard()
+    else:
+        shard = next((s for s in shards if s.guild_id == guild_id), None)
+        if shard is None: raise LookupError(f"no shard for guild {guild_id}")
+    sid = _unique_sid()
+    await _start_session(sid, shard)
     return sid
 
+async def _join_existing_session(sid: str) -> bool:
+    if not await lookup_session(sid): return False
+    await _update_count(sid, +1)
+    return True
+
+def start_auto_session_async(guild_id: Optional[int] = None) -> Future:
+    """Future[str]: the new session's sid."""
+    return asyncio.run_coroutine_threadsafe(_start_auto_session(guild_id), bot.loop)
+
+def join_existing_session_async(sid: str) -> Future:
+    """Future[bool]: False if <sid> isn't a live session."""
+    return asyncio.run_coroutine_threadsafe(_join_existing_session(sid), bot.loop)
+
+def leave_session_async(sid: str) -> Future:
+    return asyncio.run_coroutine_threadsafe(_update_count(sid, -1), bot.loop)
+
+def forget_session_key(sid: str) -> None:
+    """Drop <sid>'s local key and the inbound/outbound state that only served it."""
+    crypter.clear_session(sid)
+    bot.loop.call_soon_threadsafe(_close_inbound, sid)
+
+def start_auto_session_from_thread(guild_id: Optional[int] = None) -> str:
+    return start_auto_session_async(guild_id).result()
+
 def join_session_from_thread(sid: str) -> None:
     asyncio.run_coroutine_threadsafe(_update_count(sid, +1), bot.loop).result()
 
 def leave_session_from_thread(sid: str) -> None:
-    asyncio.run_coroutine_threadsafe(_update_count(sid, -1), bot.loop).result()
+    leave_session_async(sid).result()
+
+def drain_pool_from_thread(timeout: float = 10) -> None:
+    asyncio.run_coroutine_threadsafe(drain_channel_pool(), bot.loop).result(timeout)
+
+def session_exists_from_thread(sid: str, timeout: float = 5) -> bool:
+    return asyncio.run_coroutine_threadsafe(lookup_session(sid), bot.loop).result(timeout)
+
+def send_session_message_from_thread(sid: str, content: str) -> Future:
+    """Queue an already-encoded payload; the future yields its delivery latency."""
+    return asyncio.run_coroutine_threadsafe(_send_to_channel(sid, content), bot.loop)
+
+def send_encrypted_from_thread(sid: str, plain: str) -> Future:
+    """Encrypt <plain> in the crypto pool, then send it; returns the delivery future."""
+    return asyncio.run_coroutine_threadsafe(_encrypt_and_send(sid, plain), bot.loop)
 
-def send_session_message_from_thread(sid: str, content: str) -> None:
-    asyncio.run_coroutine_threadsafe(_send_to_channel(sid, content), bot.loop)
+def send_image_from_thread(sid: str, data: bytes, sender: str,
+                           progress: Optional[Callable[[float], None]] = None,
+                           cancel: Optional[threading.Event] = None) -> Future:
+    """Encrypt <data> and post it as an attachment; the future yields delivery latency."""
+    return asyncio.run_coroutine_threadsafe(
+        _send_image(sid, data, sender, progress, cancel), bot.loop)
+
+def image_blob_async(digest: str) -> Future:
+    """Future[bytes]: a received (or sent) image by content hash."""
+    return asyncio.run_coroutine_threadsafe(_get_blob(digest), bot.loop)
 
 def register_receive_callback(sid: str, cb: Callable[[str], None]) -> None:
     receive_handlers.setdefault(sid, []).append(cb)
@@ -165,69 +550,771 @@ def unregister_receive_callback(sid: str, cb: Callable[[str], None]) -> None:
     handlers = receive_handlers.get(sid, [])
     if cb in handlers: handlers.remove(cb)
 
-# ───────────────────────── send helper ──────────────────────────────────
-async def _send_to_channel(sid: str, content: str) -> None:
-    ch_id = session_channel_ids.get(sid);
-    if not ch_id: return
-    guild = bot.guilds[0]
-    ch = guild.get_channel(ch_id)
-    if isinstance(ch, discord.TextChannel):
-        await ch.send(content)
-
-# ───────────────────────── boot-time sync ───────────────────────────────
-async def sync_active_sessions() -> None:
-    chan = bot.get_channel(SESSIONS_CHANNEL_ID) or await bot.fetch_channel(SESSIONS_CHANNEL_ID)
-    if not isinstance(chan, discord.TextChannel): return
-    session_message_ids.clear(); session_channel_ids.clear()
-    session_counts.clear();      session_last_seen.clear()
-    async for msg in chan.history(limit=None):
-        if not msg.webhook_id: continue
-        try: sid, n = msg.content.strip().split("|", 1); n = int(n)
-        except ValueError: continue
-        session_message_ids[sid] = msg.id
-        session_counts[sid]      = n
-        session_last_seen[sid]   = datetime.now(timezone.utc)
-    # channels
-    if bot.guilds:
-        guild = bot.guilds[0]
-        for sid in session_counts:
-            ch = discord.utils.get(guild.channels, name=sid)
-            if isinstance(ch, discord.TextChannel):
-                session_channel_ids[sid] = ch.id
+# ───────────────────────── session webhooks ─────────────────────────────
+# Each session channel gets a webhook created by the bot (shared by every
+# client: the lowest-id one is used). Sends through it are billed to that
+# webhook rather than the bot's global limit, run on their own HTTP session
+# apart from counter edits, and add a second per-channel bucket next to the
+# bot's. Hooks stay with a channel through pool reuse and are forgotten when
+# the channel is deleted.
+class _HookSet:
+    """The bot's webhooks in one channel: which to send through, and the ids
+    whose messages count as ours."""
+
+    def __init__(self):
+        self.send: Optional[Webhook] = None
+        self.ids: set = set()
+        self.checked = 0.0                  # monotonic time of the last listing
+        self.lock = asyncio.Lock()
+
+async def _channel_hooks(ch: discord.TextChannel, refresh: bool = False) -> _HookSet:
+    """List (and if needed create) the bot's webhooks in <ch> once; <refresh>
+    re-lists at most every HOOK_RECHECK s. Failures leave sends on the bot."""
+    hooks = channel_hooks.get(ch.id)
+    if hooks is None: hooks = channel_hooks[ch.id] = _HookSet()
+    async with hooks.lock:
+        if hooks.checked and not (refresh and time.monotonic() - hooks.checked > HOOK_RECHECK):
+            return hooks
+        hooks.checked = time.monotonic()
+        try:
+            mine = [h for h in await _api("channel.webhooks", ch.webhooks())
+                    if h.user is not None and bot.user is not None and h.user.id == bot.user.id]
+            if not mine and SEND_VIA_WEBHOOK:
+                mine = [await _api("channel.create_webhook", ch.create_webhook(name=HOOK_NAME))]
+        except discord.HTTPException as e:
+            print(f"[HOOK] {ch.id}: {e}; sending as the bot"); return hooks
+        hooks.ids = {h.id for h in mine}
+        usable = min((h for h in mine if h.token), key=lambda h: h.id, default=None)
+        if usable is not None:
+            hooks.send = Webhook.partial(usable.id, usable.token, session=_get_hook_http())
+    return hooks
+
+async def _from_us(msg: discord.Message) -> bool:
+    """Sent by the bot account, directly or through one of its webhooks."""
+    hooks = channel_hooks.get(msg.channel.id)
+    if not msg.webhook_id:
+        if hooks is not None and hooks.lock.locked():
+            async with hooks.lock: pass         # don't overtake a message waiting on the listing
+        return bot.user is not None and msg.author.id == bot.user.id
+    hooks = await _channel_hooks(msg.channel)
+    if msg.webhook_id not in hooks.ids: hooks = await _channel_hooks(msg.channel, refresh=True)
+    return msg.webhook_id in hooks.ids
+
+# ───────────────────────── outbound scheduler ───────────────────────────
+# One FIFO per channel. Payloads queued while the channel's buckets are empty
+# are packed, newline-separated, into a single Discord message; base64 text
+# never contains "\n", so on_message can split them back apart. A payload
+# with an attachment always goes out on its own. Messages go out one at a
+# time (so in order) through whichever lane frees first: the channel's
+# webhook or the bot itself.
+class _Bucket:
+    """Sliding-window budget of <rate> sends per <window> seconds."""
+
+    def __init__(self, rate: int, window: float):
+        self.rate, self.window = rate, window
+        self.sent: Deque[float] = deque()
+
+    def wait(self, now: float) -> float:
+        while self.sent and now - self.sent[0] >= self.window: self.sent.popleft()
+        return 0.0 if len(self.sent) < self.rate else self.window - (now - self.sent[0])
+
+class _ChannelSender:
+    """Rate-limit-aware, order-preserving sender for one session channel."""
+
+    def __init__(self, ch_id: int):
+        self.ch_id = ch_id
+        self.queue: Deque[Tuple[str, Optional[BinaryIO], float, asyncio.Future]] = deque()
+        self.bot_bucket  = _Bucket(SEND_RATE, SEND_WINDOW)
+        self.hook_bucket = _Bucket(HOOK_SEND_RATE, HOOK_SEND_WINDOW)
+        self.task:  Optional[asyncio.Task] = None
+
+    def enqueue(self, content: str, fp: Optional[BinaryIO] = None) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        fut  = loop.create_future()
+        self.queue.append((content, fp, loop.time(), fut))
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        return fut
+
+    async def _lane(self) -> Tuple[_Bucket, Optional[Webhook]]:
+        """Wait until the webhook's or the bot's bucket has room, preferring the webhook."""
+        hook = None
+        ch   = bot.get_channel(self.ch_id)
+        if SEND_VIA_WEBHOOK and isinstance(ch, discord.TextChannel):
+            hook = (await _channel_hooks(ch)).send
+        lanes = ([(self.hook_bucket, hook)] if hook is not None else []) + [(self.bot_bucket, None)]
+        loop  = asyncio.get_running_loop()
+        bucket, hook = min(lanes, key=lambda lane: lane[0].wait(loop.time()))
+        delay = bucket.wait(loop.time())
+        if delay > 0: await asyncio.sleep(delay)
+        return bucket, hook
+
+    def _take_batch(self) -> List[Tuple[str, Optional[BinaryIO], float, asyncio.Future]]:
+        batch = [self.queue.popleft()]
+        size  = len(batch[0][0])
+        while PACK_MESSAGES and self.queue and batch[0][1] is None and self.queue[0][1] is None:
+            nxt = len(self.queue[0][0]) + 1
+            if size + nxt > MAX_MESSAGE_LEN: break
+            batch.append(self.queue.popleft()); size += nxt
+        return batch
+
+    async def _send(self, ch: discord.TextChannel, hook: Optional[Webhook],
+                    content: str, fp: Optional[BinaryIO]) -> None:
+        if hook is not None:
+            if fp is None: await _api("webhook.send", hook.send(content))
+            else:          await _api("webhook.send_file",
+                                      hook.send(content, file=discord.File(fp, filename="blob.bin")))
+        elif fp is None:   await _api("channel.send", ch.send(content))
+        else:              await _api("channel.send_file",
+                                      ch.send(content, file=discord.File(fp, filename="blob.bin")))
+
+    async def _deliver(self, bucket: _Bucket, hook: Optional[Webhook],
+                       batch: List[Tuple[str, Optional[BinaryIO], float, asyncio.Future]]) -> None:
+        fp = batch[0][1]
+        for attempt in range(3):
+            ch = bot.get_channel(self.ch_id)
+            if not isinstance(ch, discord.TextChannel):
+                raise LookupError(f"channel {self.ch_id} is gone")
+            try:
+                return await self._send(ch, hook, "\n".join(c for c, _, _, _ in batch), fp)
+            except discord.HTTPException as e:
+                if e.status != 429 or fp is not None or attempt == 2: raise   # a sent File is closed
+                send_stats["rate_limited"] += 1
+                sid = channel_sessions.get(self.ch_id)
+                if sid: _shard_of(sid).rate_limited += 1
+                metrics.inc("discord_rate_limited_total")
+                await asyncio.sleep(bucket.window * (attempt + 1))
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while self.queue:
+            batch: List[Tuple[str, Optional[BinaryIO], float, asyncio.Future]] = []
+            err: Optional[Exception] = None
+            try:
+                bucket, hook = await self._lane()
+                batch = self._take_batch()
+                try: await self._deliver(bucket, hook, batch)
+                finally: bucket.sent.append(loop.time())
+            except Exception as e:              # HTTP, connection reset, timeout, webhook listing …
+                if not isinstance(e, discord.HTTPException):
+                    print(f"[SEND] {self.ch_id}: {e!r}")
+                err = e
+                if not batch: batch = self._take_batch()
+            now = loop.time()
+            if err is None:
+                send_stats["messages"] += 1; send_stats["payloads"] += len(batch)
+                if hook is not None: send_stats["via_webhook"] += 1
+            fp = batch[0][1]
+            if fp is not None: fp.close()
+            for _, _, queued, fut in batch:
+                if fut.done(): continue
+                if err is None: fut.set_result(now - queued)
+                else:           fut.set_exception(err)
+
+def _enqueue_send(sid: str, content: str, fp: Optional[BinaryIO] = None) -> asyncio.Future:
+    ch_id = session_channel_ids.get(sid)
+    if not ch_id: raise LookupError(f"no channel for session {sid}")
+    sender = outbound_senders.get(ch_id)
+    if sender is None:
+        sender = outbound_senders[ch_id] = _ChannelSender(ch_id)
+    return sender.enqueue(content, fp)
 
-# ───────────────────────── bot events & idle cleanup ────────────────────
+async def _send_to_channel(sid: str, content: str) -> float:
+    """Queue <content> for the session channel; returns the delivery latency in s."""
+    return await _enqueue_send(sid, content)
+
+# ───────────────────────── crypto worker pool ───────────────────────────
+def _get_pool() -> Executor:
+    global crypto_pool
+    if crypto_pool is None:
+        if CRYPTO_POOL == "process":
+            crypto_pool = ProcessPoolExecutor(max_workers=CRYPTO_WORKERS)
+        else:
+            crypto_pool = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS,
+                                             thread_name_prefix="crypto")
+    return crypto_pool
+
+def _timed_job(op: str, job: "asyncio.Future[T]") -> "asyncio.Future[T]":
+    # submit → result, so pool queueing shows up next to the crypto itself
+    t = time.perf_counter()
+    job.add_done_callback(lambda _: metrics.observe("crypto_seconds", time.perf_counter() - t, op=op))
+    return job
+
+async def _encrypt_and_send(sid: str, plain: str) -> float:
+    pwd = crypter.session_passwords.get(sid)
+    if pwd is None: raise LookupError(f"session {sid} is not joined")
+    loop = asyncio.get_running_loop()
+    job  = _timed_job("encrypt", loop.run_in_executor(
+        _get_pool(), crypter.worker_encode, sid, pwd, plain, WIRE_VERSION))
+    lock = outbound_locks.setdefault(sid, asyncio.Lock())
+    async with lock:                    # FIFO: later encrypts queue after earlier ones
+        delivered = _enqueue_send(sid, await job)
+    latency = await delivered
+    metrics.inc("messages_sent_total", session=sid)
+    return latency
+
+def _foreign(sid: str, content: str) -> bool:
+    # v2 payloads name their key up front; another key's payloads are never ours
+    kid, ours = crypter.peek_key_id(content), crypter.key_id(sid)
+    return kid is not None and ours is not None and kid != ours
+
+def _over_budget(sid: str) -> bool:
+    times = decrypt_failures.get(sid)
+    if not times: return False
+    while times and time.monotonic() - times[0] > DECRYPT_FAIL_WINDOW: times.popleft()
+    return len(times) >= DECRYPT_FAIL_LIMIT
+
+def _record_decrypt_failure(sid: str) -> None:
+    metrics.inc("decrypt_failures_total", session=sid)
+    was   = _over_budget(sid)
+    times = decrypt_failures.setdefault(sid, deque(maxlen=DECRYPT_FAIL_LIMIT))
+    times.append(time.monotonic())
+    if not was and _over_budget(sid):
+        print(f"[RECV] {sid}: {DECRYPT_FAIL_LIMIT} failed decrypts, shedding PBKDF2 payloads for a while")
+
+def _shed(sid: str, content: str) -> bool:
+    # over budget only the expensive legacy format is skipped: v1/v2 payloads
+    # cost one MAC check, so messages that authenticate still get through
+    if not crypter.needs_kdf(content) or not _over_budget(sid): return False
+    metrics.inc("decrypt_shed_total", session=sid)
+    return True
+
+def _submit_inbound(sid: str, content: str, attachment: Optional[str] = None) -> None:
+    """Queue a payload for <sid>'s dispatcher; dropped (and counted) when the backlog is full.
+
+    Payloads tagged with another key never reach the pool, and while the session
+    keeps failing decrypts, payloads that would need a PBKDF2 run are shed.
+    """
+    if _foreign(sid, content):
+        metrics.inc("decrypt_foreign_total", session=sid); return
+    if _shed(sid, content): return
+    queue = inbound_queues.get(sid)
+    if queue is None:
+        queue = inbound_queues[sid] = asyncio.Queue(maxsize=INBOUND_QUEUE_SIZE)
+        inbound_tasks[sid] = asyncio.create_task(_dispatch_inbound(sid, queue))
+    try: queue.put_nowait((content, attachment))
+    except asyncio.QueueFull:
+        metrics.inc("inbound_dropped_total", session=sid)
+
+async def _dispatch_inbound(sid: str, queue: "asyncio.Queue[Tuple[str, Optional[str]]]") -> None:
+    # decrypts are submitted from here, at most INBOUND_INFLIGHT at a time, so
+    # a busy session can't fill the shared pool ahead of everyone else's
+    loop = asyncio.get_running_loop()
+    inflight: Deque[Tuple["asyncio.Future[str]", Optional[str]]] = deque()
+    while True:
+        if not inflight or (len(inflight) < INBOUND_INFLIGHT and not queue.empty()):
+            content, attachment = await queue.get()
+            pwd = crypter.session_passwords.get(sid)
+            if pwd is None or _shed(sid, content): continue   # left, or over budget since queued
+            inflight.append((_timed_job("decrypt", loop.run_in_executor(
+                _get_pool(), crypter.worker_decode, sid, pwd, content)), attachment))
+            continue
+        job, attachment = inflight.popleft()
+        try: plain = await job
+        except crypter.KeyMismatch:             # another session's key: nothing to hold against it
+            metrics.inc("decrypt_foreign_total", session=sid); continue
+        except Exception:                       # wrong password, corrupt or forged payload
+            _record_decrypt_failure(sid); continue
+        metrics.inc("messages_received_total", session=sid)
+        digest = image_ref(plain)
+        if attachment and digest: _start_blob_fetch(sid, attachment, digest)
+        for cb in list(receive_handlers.get(sid, [])):
+            try: cb(plain)
+            except Exception as e: print(f"[RECV] {sid}: handler error: {e}")
+
+def _close_inbound(sid: str) -> None:
+    decrypt_failures.pop(sid, None)
+    inbound_queues.pop(sid, None)
+    outbound_locks.pop(sid, None)
+    task = inbound_tasks.pop(sid, None)
+    if task: task.cancel()
+
+# ───────────────────────── encrypted images ─────────────────────────────
+# An image is sent as a Discord attachment holding the crypter stream of its
+# bytes, captioned with the encrypted text "<sender>:[image:<hash>]". Receivers
+# decrypt while downloading and keep the plaintext by content hash.
+IMAGE_MARKER = re.compile(r":\[image:([0-9a-f]{32})\]$")
+
+class TransferCancelled(Exception):
+    pass
+
+class _BlobCache:
+    """Byte-bounded LRU of content hash → decrypted bytes."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes, self.size = max_bytes, 0
+        self._items: "OrderedDict[str, bytes]" = OrderedDict()
+
+    def get(self, digest: str) -> Optional[bytes]:
+        data = self._items.get(digest)
+        if data is not None: self._items.move_to_end(digest)
+        return data
+
+    def put(self, digest: str, data: bytes) -> None:
+        if len(data) > self.max_bytes: return
+        old = self._items.pop(digest, None)
+        if old is not None: self.size -= len(old)
+        self._items[digest] = data; self.size += len(data)
+        while self.size > self.max_bytes:
+            self.size -= len(self._items.popitem(last=False)[1])
+
+blob_cache = _BlobCache(BLOB_CACHE_BYTES)
+
+def image_ref(plain: str) -> Optional[str]:
+    """Content hash if <plain> is an image caption, else None."""
+    m = IMAGE_MARKER.search(plain)
+    return m.group(1) if m else None
+
+def _content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:32]
+
+def _encrypt_blob(sid: str, data: bytes, progress: Optional[Callable[[float], None]],
+                  cancel: Optional[threading.Event]) -> BinaryIO:
+    """Stream-encrypt <data> into a temp file that spills to disk past 1 MiB."""
+    enc = crypter.StreamEncryptor(sid)
+    out = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    step = crypter.STREAM_CHUNK
+    for off in range(0, len(data), step):
+        if cancel is not None and cancel.is_set():
+            out.close(); raise TransferCancelled()
+        out.write(enc.update(data[off:off + step]))
+        if progress: progress(min(1.0, (off + step) / len(data)))
+    out.write(enc.finalize()); out.seek(0)
+    return out  # type: ignore[return-value]
+
+async def _send_image(sid: str, data: bytes, sender: str,
+                      progress: Optional[Callable[[float], None]] = None,
+                      cancel: Optional[threading.Event] = None) -> float:
+    if len(data) > MAX_IMAGE_BYTES: raise ValueError("image too large")
+    pwd = crypter.session_passwords.get(sid)
+    if pwd is None: raise LookupError(f"session {sid} is not joined")
+    digest = _content_hash(data)
+    blob_cache.put(digest, data)            # our own echo renders from cache
+    loop = asyncio.get_running_loop()
+    caption = loop.run_in_executor(_get_pool(), crypter.worker_encode, sid, pwd,
+                                   f"{sender}:[image:{digest}]", WIRE_VERSION)
+    blob = loop.run_in_executor(None, _encrypt_blob, sid, data, progress, cancel)
+    lock = outbound_locks.setdefault(sid, asyncio.Lock())
+    async with lock:
+        try: fp = await blob
+        except BaseException: caption.cancel(); raise
+        delivered = _enqueue_send(sid, await caption, fp)
+    return await delivered
+
+async def _fetch_blob(sid: str, url: str, digest: str) -> bytes:
+    dec, out = crypter.StreamDecryptor(sid), bytearray()
+    async with _get_http().get(url) as resp:
+        resp.raise_for_status()
+        async for chunk in resp.content.iter_chunked(crypter.STREAM_CHUNK):
+            out += dec.update(chunk)
+            if len(out) > MAX_IMAGE_BYTES: raise ValueError("image too large")
+    out += dec.finalize()
+    data = bytes(out)
+    if _content_hash(data) != digest: raise ValueError("image hash mismatch")
+    blob_cache.put(digest, data)
+    return data
+
+def _start_blob_fetch(sid: str, url: str, digest: str) -> None:
+    if blob_cache.get(digest) is not None or digest in blob_tasks: return
+    task = blob_tasks[digest] = asyncio.create_task(_fetch_blob(sid, url, digest))
+    def done(t: asyncio.Task):
+        blob_tasks.pop(digest, None)
+        if not t.cancelled() and t.exception():
+            print(f"[IMAGE] {sid}: {t.exception()}")
+    task.add_done_callback(done)
+
+async def _get_blob(digest: str) -> bytes:
+    data = blob_cache.get(digest)
+    if data is not None: return data
+    task = blob_tasks.get(digest)
+    if task is None: raise KeyError(digest)
+    return await asyncio.shield(task)
+
+# ───────────────────────── history replay ───────────────────────────────
+# Late joiners read the session channel backwards one page at a time. Only
+# the page asked for is decrypted, and nothing past HISTORY_HORIZON is read.
+def history_cursor() -> int:
+    """Where paging starts for a session joined now; newer messages arrive live."""
+    return discord.utils.time_snowflake(datetime.now(timezone.utc))
+
+async def _history_page(sid: str, before: int, limit: int) -> Tuple[List[Tuple[str, float]], Optional[int]]:
+    pwd = crypter.session_passwords.get(sid)
+    if pwd is None: raise LookupError(f"session {sid} is not joined")
+    ch_id = session_channel_ids.get(sid)
+    chan  = bot.get_channel(ch_id) if ch_id else None
+    if not isinstance(chan, discord.TextChannel) or bot.user is None: return [], None
+    horizon = discord.utils.time_snowflake(datetime.now(timezone.utc) - timedelta(seconds=HISTORY_HORIZON))
+    loop = asyncio.get_running_loop()
+    jobs: List[Tuple["asyncio.Future[str]", float, Optional[str]]] = []  # decrypt, unix time, attachment
+    cursor: Optional[int] = None
+    async for msg in chan.history(limit=None, before=discord.Object(id=before)):
+        if msg.id <= horizon: cursor = None; break
+        cursor = msg.id
+        if not await _from_us(msg): continue
+        sent = discord.utils.snowflake_time(msg.id).timestamp()
+        url  = msg.attachments[0].url if msg.attachments else None
+        for part in reversed([p for p in msg.content.split("\n") if p]):   # newest first
+            if _foreign(sid, part): continue
+            jobs.append((_timed_job("history", loop.run_in_executor(
+                _get_pool(), crypter.worker_decode, sid, pwd, part)), sent, url))
+        if len(jobs) >= limit: break
+    else:
+        cursor = None                           # reached the start of the channel
+    lines = []
+    for job, sent, url in jobs:
+        try: plain = await job
+        except Exception:
+            metrics.inc("history_skipped_total", session=sid); continue
+        digest = image_ref(plain)
+        if url and digest: _start_blob_fetch(sid, url, digest)
+        lines.append((plain, sent))
+    return lines, cursor
+
+def history_page_async(sid: str, before: int, limit: int = HISTORY_PAGE) -> Future:
+    """Future[(lines, cursor)]: about <limit> (plaintext, unix time) pairs sent
+    before message id <before>, newest first. Pass <cursor> back for the next
+    page; None means the channel start or the horizon was reached."""
+    return asyncio.run_coroutine_threadsafe(_history_page(sid, before, limit), bot.loop)
+
+# ───────────────────────── session sync ─────────────────────────────────
+def _parse_counter(content: str) -> Optional[Tuple[str, int]]:
+    try: sid, n = content.strip().split("|", 1); return sid, int(n)
+    except ValueError: return None
+
+async def _sessions_channel(shard: Shard) -> Optional[discord.TextChannel]:
+    cid  = shard.sessions_channel_id
+    chan = bot.get_channel(cid) or await bot.fetch_channel(cid)
+    return chan if isinstance(chan, discord.TextChannel) else None
+
+def _drop_session_state(sid: str) -> None:
+    session_message_ids.pop(sid, None); session_counts.pop(sid, None)
+    session_last_seen.pop(sid, None);   _unbind_channel(sid)
+    stale_counts.discard(sid)
+    shard = session_shards.pop(sid, None)
+    if shard: shard.sids.discard(sid)
+
+def _apply_counter(shard: Shard, msg_id: int, content: str) -> Optional[str]:
+    """Fold one <sid>|<n> counter message (new or edited) into local state."""
+    parsed = _parse_counter(content)
+    if parsed is None: return None
+    sid, n = parsed
+    _place_session(sid, shard)
+    stale_counts.discard(sid)
+    session_message_ids[sid] = msg_id
+    session_counts[sid]      = n
+    session_last_seen.setdefault(sid, datetime.now(timezone.utc))
+    idle_expiry.watch(sid)
+    if shard.high_water is None or msg_id > shard.high_water:
+        shard.high_water = msg_id
+    return sid
+
+def _forget_counter(msg_id: int) -> None:
+    for sid, mid in list(session_message_ids.items()):
+        if mid == msg_id: _drop_session_state(sid)
+
+def _bind_channels(shard: Shard, sids) -> None:
+    """Attach channels to <sids> in one pass over the shard guild's text channels."""
+    wanted = {sid for sid in sids if sid not in session_channel_ids}
+    guild  = shard.guild()
+    if not wanted or guild is None: return
+    for ch in guild.text_channels:
+        if ch.name in wanted:
+            _bind_channel(ch.name, ch.id)
+
+async def _sync_shard(shard: Shard, full: bool) -> None:
+    async with shard.sync_lock:
+        chan = await _sessions_channel(shard)
+        if chan is None: return
+        if not shard.guild_id: shard.guild_id = chan.guild.id
+        rescan = full or shard.high_water is None
+        known  = set(shard.sids)
+        if rescan:
+            # state stays in place while the counters are re-read, so live
+            # sessions keep their channels and idle clocks throughout
+            shard.high_water = None
+            history = chan.history(limit=None, oldest_first=True)
+        else:
+            history = chan.history(limit=None, after=discord.Object(id=shard.high_water),
+                                   oldest_first=True)
+        seen = []
+        async for msg in history:
+            if msg.webhook_id and (sid := _apply_counter(shard, msg.id, msg.content)):
+                seen.append(sid)
+        if rescan:                              # counters deleted since we last looked
+            for sid in known.difference(seen): _drop_session_state(sid)
+        _bind_channels(shard, shard.sids if rescan else seen)
+
+async def sync_active_sessions(full: bool = False) -> None:
+    """Fetch counter messages newer than each shard's high-water mark
+    (everything if <full>).
+
+    Edits and deletes of older counters arrive live through the gateway
+    handlers below, so an incremental pass is usually a single history page
+    per shard.
+    """
+    with metrics.timer("sync_seconds", full=full):
+        await asyncio.gather(*(_sync_shard(shard, full) for shard in shards))
+
+async def lookup_session(sid: str) -> bool:
+    """True if <sid> is live; a miss costs one incremental fetch, not a rescan."""
+    if sid not in session_counts:
+        await sync_active_sessions()
+    return sid in session_counts
+
+# ───────────────────────── idle expiry ──────────────────────────────────
+def _last_activity(sid: str) -> Optional[datetime]:
+    last = session_last_seen.get(sid)
+    ch   = bot.get_channel(session_channel_ids.get(sid, 0))
+    if isinstance(ch, discord.TextChannel) and ch.last_message_id:
+        posted = discord.utils.snowflake_time(ch.last_message_id)
+        if last is None or posted > last: last = posted
+    return last
+
+class _IdleExpiry:
+    """Ends sessions IDLE_TIMEOUT after their last payload.
+
+    A heap holds one deadline per session. Payloads only update
+    session_last_seen; a popped deadline that turns out to be early is pushed
+    back at the real one, so the heap is touched about once per timeout per
+    session rather than per message. Expiry ends the whole session (the
+    count goes to 0) — joins and leaves are the only per-user changes.
+    Activity is the newer of session_last_seen and the channel's
+    last_message_id, which comes with the guild payload, so traffic this
+    process missed (not joined, disconnected) still counts. A session whose
+    channel is gone can't get any, so it ends once idle.
+    """
+
+    def __init__(self):
+        self.heap: List[Tuple[float, str]] = []
+        self.deadlines: Dict[str, float] = {}   # SID → the deadline its live heap entry holds
+        self.wake: Optional[asyncio.Event] = None
+        self.task: Optional[asyncio.Task] = None
+        self.expiring: set = set()              # SIDs being torn down right now
+        self.expired = 0
+
+    def watch(self, sid: str, at: Optional[float] = None) -> None:
+        """(Re)arm <sid>'s deadline; only an earlier deadline needs a new entry."""
+        if at is None:
+            last = session_last_seen.get(sid)
+            at = (last.timestamp() if last else time.time()) + IDLE_TIMEOUT
+        current = self.deadlines.get(sid)
+        if current is not None and current <= at: return
+        self.deadlines[sid] = at
+        heapq.heappush(self.heap, (at, sid))
+        if self.wake is not None and self.heap[0][1] == sid: self.wake.set()
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.wake = asyncio.Event()
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        gate = asyncio.Semaphore(EXPIRY_CONCURRENCY)
+        while True:
+            assert self.wake is not None
+            self.wake.clear()
+            delay = self.heap[0][0] - time.time() if self.heap else None
+            if delay is None or delay > 0:
+                try: await asyncio.wait_for(self.wake.wait(), delay)
+                except asyncio.TimeoutError: pass
+                continue
+            at, sid = heapq.heappop(self.heap)
+            if self.deadlines.get(sid) != at: continue          # superseded entry
+            del self.deadlines[sid]
+            if sid not in session_counts or sid in self.expiring: continue   # gone or going
+            last = _last_activity(sid)
+            due  = (last.timestamp() if last else at) + IDLE_TIMEOUT
+            if due > time.time():                                # activity since: not yet
+                self.watch(sid, due); continue
+            await gate.acquire()
+            self.expiring.add(sid)
+            asyncio.create_task(self._expire(sid, gate))
+
+    async def _expire(self, sid: str, gate: asyncio.Semaphore) -> None:
+        try:
+            print(f"[IDLE] {sid}: no payloads for {IDLE_TIMEOUT:g}s, ending session")
+            await _update_count(sid, -(session_counts.get(sid) or 1))
+            self.expired += 1
+        except Exception as e:
+            print(f"[IDLE] {sid}: teardown failed: {e}")
+            if sid in session_counts: self.watch(sid, time.time() + 60)
+        finally:
+            self.expiring.discard(sid)
+            gate.release()
+
+idle_expiry = _IdleExpiry()
+
+# ───────────────────────── local state snapshot ─────────────────────────
+def _state_row(sid: str) -> Optional[snapshot.SessionRow]:
+    if sid not in session_counts: return None
+    last = session_last_seen.get(sid) or datetime.now(timezone.utc)
+    return snapshot.SessionRow(sid, _shard_of(sid).sessions_channel_id,
+                               session_message_ids.get(sid), session_channel_ids.get(sid),
+                               session_counts[sid], last.timestamp())
+
+async def flush_state() -> None:
+    """Journal every session changed since the last flush (off the loop thread)."""
+    if state_store is None: return
+    marks = {s.sessions_channel_id: s.high_water for s in shards if s.high_water is not None}
+    if not state_dirty and marks == state_marks: return
+    dirty = list(state_dirty); state_dirty.clear()
+    rows  = [r for r in map(_state_row, dirty) if r is not None]
+    gone  = [sid for sid in dirty if sid not in session_counts]
+    try:
+        await asyncio.to_thread(state_store.append, rows, gone, marks)
+    except Exception as e:
+        state_dirty.update(dirty); print(f"[STATE] journal write failed: {e}"); return
+    state_marks.clear(); state_marks.update(marks)
+
+def _restore_state() -> bool:
+    """Load the last snapshot into memory; False if there was nothing usable."""
+    if state_store is None: return False
+    rows, marks, saved_at = state_store.load()
+    if saved_at is None or datetime.now(timezone.utc) - datetime.fromtimestamp(
+            saved_at, timezone.utc) > SNAPSHOT_MAX_AGE:
+        return False
+    for row in rows.values():
+        shard = shard_by_channel.get(row.shard)
+        if shard is None: continue                  # shard no longer configured
+        _place_session(row.sid, shard)
+        if row.msg_id: session_message_ids[row.sid] = row.msg_id
+        if row.ch_id:  _bind_channel(row.sid, row.ch_id)
+        session_counts[row.sid]    = row.count
+        session_last_seen[row.sid] = datetime.fromtimestamp(row.last_seen, timezone.utc)
+        idle_expiry.watch(row.sid)
+        stale_counts.add(row.sid)                   # edits made while we were away
+    for shard in shards:
+        shard.high_water = marks.get(shard.sessions_channel_id)
+    state_marks.update(marks); state_dirty.clear()
+    print(f"[STATE] restored {len(session_counts)} sessions from {STATE_DB}")
+    return True
+
+def _reconcile_restored() -> None:
+    """Drop restored sessions whose channel went away while we were offline.
+
+    A session channel lives exactly as long as its session, and the guild's
+    channel list arrives with the gateway handshake, so this costs no requests.
+    """
+    for shard in shards:
+        guild = shard.guild()
+        if guild is None: continue
+        names = {ch.name: ch.id for ch in guild.text_channels}
+        for sid in list(shard.sids):
+            if sid not in stale_counts: continue     # already seen fresh this run
+            ch_id = session_channel_ids.get(sid)
+            ch    = guild.get_channel(ch_id) if ch_id else None
+            if ch is not None and ch.name == sid: continue
+            if sid in names: _bind_channel(sid, names[sid])
+            else:            _drop_session_state(sid)
+
+@tasks.loop(seconds=STATE_FLUSH)
+async def persist_state():
+    await flush_state()
+
+# ───────────────────────── metrics export ───────────────────────────────
+metrics.gauge("sessions_active", lambda: len(session_counts), doc="sessions known to this bot")
+metrics.gauge("sessions_joined", lambda: len(crypter.session_keys), doc="sessions with a local key")
+metrics.gauge("inbound_queue_depth", lambda: {sid: q.qsize() for sid, q in inbound_queues.items()},
+              label="session", doc="decrypts waiting per session")
+metrics.gauge("outbound_queue_depth", lambda: sum(len(s.queue) for s in outbound_senders.values()),
+              doc="payloads waiting for a channel send")
+metrics.gauge("outbound_totals", lambda: dict(send_stats), label="kind",
+              doc="messages sent, payloads packed into them, 429s retried")
+metrics.gauge("counter_totals", lambda: dict(counter_stats), label="kind",
+              doc="counter updates requested vs written after debouncing")
+metrics.gauge("shard_sessions", lambda: {s.guild_id: len(s.sids) for s in shards}, label="guild")
+metrics.gauge("shard_rate_limited", lambda: {s.guild_id: s.rate_limited for s in shards}, label="guild")
+metrics.gauge("channel_pool_spares", lambda: {s.guild_id: len(s.pool) for s in shards}, label="guild")
+metrics.gauge("blob_cache_bytes", lambda: blob_cache.size)
+metrics.gauge("profiling", lambda: int(metrics.profiling()))
+metrics.gauge("idle_expired", lambda: idle_expiry.expired, doc="sessions ended for inactivity")
+metrics.gauge("idle_watched", lambda: len(idle_expiry.deadlines))
+
+@tasks.loop(seconds=METRICS_DUMP_EVERY)
+async def dump_metrics():
+    try: await asyncio.to_thread(metrics.dump_json, METRICS_DUMP)
+    except OSError as e: print(f"[METRICS] dump failed: {e}")
+
+async def _start_metrics() -> None:
+    global metrics_runner
+    if METRICS_PORT and metrics_runner is None:
+        metrics_runner = await metrics.serve(METRICS_HOST, METRICS_PORT, METRICS_PROFILE)
+        print(f"[METRICS] serving on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    if METRICS_DUMP and not dump_metrics.is_running(): dump_metrics.start()
+
+# ───────────────────────── bot events ────────────────────
 @bot.event
 async def on_ready():
-    await sync_active_sessions()
-    cleanup.start()
+    global pool_task, state_restored
+    reconnect = state_restored
+    if not state_restored:                      # snapshot first, then only the delta
+        state_restored = True
+        if _restore_state(): _reconcile_restored()
+    # on_ready after the first means a new gateway session: counter edits and
+    # deletes made while we were away never arrive, so re-read everything
+    await sync_active_sessions(full=reconnect)
+    idle_expiry.start()
+    if state_store is not None and not persist_state.is_running(): persist_state.start()
+    await _start_metrics()
+    if CHANNEL_POOL_SIZE and (pool_task is None or pool_task.done()):
+        for shard in shards: _adopt_pool_channels(shard)
+        pool_task = asyncio.create_task(_pool_manager())
+        pool_wanted.set()
+    elif not CHANNEL_POOL_SIZE:                 # no pool here, but clean up spares others leaked
+        for shard in shards: asyncio.create_task(_reap_pool_channels(shard))
+    ready.set()
 
 @bot.event
 async def on_message(msg: discord.Message):
     await bot.process_commands(msg)
     if msg.channel is None or bot.user is None: return
-    if msg.author.id != bot.user.id:            return
+    shard = shard_by_channel.get(msg.channel.id)
+    if shard is not None:                       # a sessions (counter) channel
+        if msg.webhook_id and (sid := _apply_counter(shard, msg.id, msg.content)):
+            _bind_channels(shard, [sid])
+        return
     if not isinstance(msg.channel, discord.TextChannel): return
-    # decrypt payload
-    for sid, ch_id in session_channel_ids.items():
-        if ch_id != msg.channel.id: continue
-        pwd = crypter.session_passwords.get(sid)
-        if not pwd: continue
-        try:
-            raw   = base64.urlsafe_b64decode(msg.content.encode())
-            plain = crypter.decrypt_message(raw, pwd)
-        except Exception: continue
-        session_last_seen[sid] = datetime.now(timezone.utc)
-        for cb in receive_handlers.get(sid, []): cb(plain)
-
-@tasks.loop(minutes=5)
-async def cleanup():
-    now = datetime.now(timezone.utc)
-    for sid, last in list(session_last_seen.items()):
-        if now - last > timedelta(minutes=30):
-            await _update_count(sid, -1)
-
-@cleanup.before_loop
-async def _wait_ready(): await bot.wait_until_ready()
+    sid = channel_sessions.get(msg.channel.id)
+    if sid is None: return                      # not a session channel
+    if not await _from_us(msg): return
+    # our payloads keep a session alive whether or not this process joined it
+    session_last_seen[sid] = datetime.now(timezone.utc); state_dirty.add(sid)
+    pwd = crypter.session_passwords.get(sid)
+    if not pwd: return                          # session we haven't joined
+    # hand payloads to the session's dispatcher; results come out in arrival order
+    if msg.attachments:
+        _submit_inbound(sid, msg.content, msg.attachments[0].url)
+        return
+    for part in msg.content.split("\n"):
+        if part: _submit_inbound(sid, part)
+
+@bot.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    shard = shard_by_channel.get(payload.channel_id)
+    if shard is None: return
+    content = payload.data.get("content")
+    if content is not None and payload.data.get("webhook_id"):
+        _apply_counter(shard, payload.message_id, content)
+
+@bot.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    if payload.channel_id in shard_by_channel:
+        _forget_counter(payload.message_id)
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    channel_hooks.pop(channel.id, None)         # its webhooks went with it
+    sid = channel_sessions.get(channel.id)
+    if sid: _unbind_channel(sid)
+
+@bot.event
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    # pooled channels change identity by rename rather than create/delete
+    if before.name == after.name: return
+    sid = channel_sessions.get(after.id)
+    if sid and sid != after.name: _unbind_channel(sid)
+    if after.name in session_counts and after.name not in session_channel_ids:
+        _bind_channel(after.name, after.id)
 
 if __name__ == "__main__":
     bot.run(BOT_TOKEN)
@@ -0,0 +1,70 @@
+# client.py — headless StealthChat participant over chat.py's thread API
+
+import queue, threading, time
+from concurrent.futures import Future
+from typing import Callable, Optional, Tuple
+
+import chat, crypter
+
+
+def start_bot(timeout: float = 30) -> None:
+    """Run chat.bot on a daemon thread (as gui.py does) and wait until it's ready."""
+    if not chat.bot.is_ready():
+        threading.Thread(target=lambda: chat.bot.run(chat.BOT_TOKEN), daemon=True).start()
+    if not chat.ready.wait(timeout): raise TimeoutError("bot did not become ready")
+
+
+class Client:
+    """One chat user without a UI: start or join a session, send, receive, leave.
+
+    Received lines are "<sender>:<body>" like the GUI's; they are put on
+    <inbox> as (sender, body, perf_counter at receipt) and passed to
+    <on_message> if set. Own lines are skipped, as the GUI does. Callbacks
+    run on the bot loop thread and must not block.
+    """
+
+    def __init__(self, name: str, on_message: Optional[Callable[[str, str], None]] = None):
+        self.name       = name
+        self.on_message = on_message
+        self.sid: Optional[str] = None
+        self.inbox: "queue.Queue[Tuple[str, str, float]]" = queue.Queue()
+
+    def _receive(self, line: str) -> None:
+        sender, _, body = line.partition(":")
+        if sender == self.name: return
+        self.inbox.put((sender, body, time.perf_counter()))
+        if self.on_message is not None: self.on_message(sender, body)
+
+    def _enter(self, sid: str, pwd: str) -> None:
+        crypter.init_session(sid, pwd)
+        self.sid = sid
+        chat.register_receive_callback(sid, self._receive)
+        self.send(f"System:{self.name} has joined the session", raw=True)
+
+    def start(self, pwd: str, timeout: float = 30) -> str:
+        """Start a new session; returns its sid."""
+        sid = chat.start_auto_session_async().result(timeout)
+        self._enter(sid, pwd)
+        return sid
+
+    def join(self, sid: str, pwd: str, timeout: float = 30) -> bool:
+        """Join a live session; False if <sid> doesn't exist."""
+        if not chat.join_existing_session_async(sid).result(timeout): return False
+        self._enter(sid, pwd)
+        return True
+
+    def send(self, text: str, raw: bool = False) -> Future:
+        """Encrypt and queue <text>; the future yields delivery latency in seconds."""
+        if self.sid is None: raise LookupError(f"{self.name} is not in a session")
+        return chat.send_encrypted_from_thread(self.sid, text if raw else f"{self.name}:{text}")
+
+    def leave(self, timeout: float = 30) -> None:
+        if self.sid is None: return
+        sid, self.sid = self.sid, None
+        try:
+            chat.send_encrypted_from_thread(sid, f"System:{self.name} has left the session").result(timeout)
+        finally:
+            chat.unregister_receive_callback(sid, self._receive)
+            chat.leave_session_async(sid).result(timeout)
+            if not chat.receive_handlers.get(sid):     # nobody else here is in it
+                chat.forget_session_key(sid)
@@ -1,31 +1,333 @@
 import base64
 import hashlib
+import hmac
+import multiprocessing
 import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import NamedTuple, Optional
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+# Wire formats (raw bytes, before the transport text encoding):
+#   legacy : salt(16) | Fernet token                     — PBKDF2 per message
+#   v1     : b"SC\x01" | session salt(16) | Fernet token — PBKDF2 once per session
+#   v2     : 0x02 | flags | nonce(12) | AES-GCM(body)    — compact, session key only
+# Fernet tokens always start with b"g" (base64 of the 0x80 version byte), which
+# is what tells a v1 header apart from a legacy salt that happens to match it.
+# Legacy and v1 travel as base64url; v2 travels as "~" + base85, and "~" is not
+# in the base64url alphabet, so receivers auto-detect the version from the text.
+# With V2_KID set the nonce starts with the session's key id, so a payload made
+# with another key is rejected before any decryption; readers that predate the
+# flag just see a nonce.
+WIRE_V1 = b"SC\x01"
+WIRE_V2 = 2
+V2_PREFIX = "~"
+V2_ZLIB = 0x01          # flags bit: body is zlib-compressed
+V2_KID = 0x02           # flags bit: nonce = key id(4) | random(8)
+SALT_LEN = 16
+NONCE_LEN = 12
+KID_LEN = 4
+KDF_ITERATIONS = 100_000
+
+
+# Streams (attachments): b"SCS\x01" | nonce prefix(7) | chunk* where each chunk
+# is AES-GCM over STREAM_CHUNK plaintext bytes (the last may be shorter) with
+# nonce = prefix | counter(4, big-endian) | last-flag(1). The flag makes a
+# truncated stream fail to authenticate instead of decrypting short.
+STREAM_MAGIC = b"SCS\x01"
+STREAM_PREFIX_LEN = 7
+STREAM_CHUNK = 64 * 1024
+STREAM_TAG = 16
+
+
+class SessionKey(NamedTuple):
+    salt: bytes
+    fernet: Fernet
+    aead: AESGCM
+    stream: AESGCM
+    kid: bytes
+
+
+class KeyMismatch(ValueError):
+    """The payload was made with a different key; rejected without decrypting."""
 
 
 session_passwords: dict[str, str] = {}
+session_keys: dict[str, SessionKey] = {}
+
+
+class _KeyCache:
+    """Thread-safe LRU/TTL cache of (password, salt) → derived key."""
+
+    def __init__(self, maxsize: int = 256, ttl: float = 1800.0):
+        self.maxsize, self.ttl = maxsize, ttl
+        self._items: OrderedDict[tuple[str, bytes], tuple[float, bytes]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pwd: str, salt: bytes) -> Optional[bytes]:
+        key = (pwd, salt)
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is None:
+                return None
+            stamp, derived = hit
+            if time.monotonic() - stamp > self.ttl:
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return derived
+
+    def put(self, pwd: str, salt: bytes, derived: bytes) -> None:
+        with self._lock:
+            self._items[(pwd, salt)] = (time.monotonic(), derived)
+            self._items.move_to_end((pwd, salt))
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def discard(self, pwd: str, salt: bytes) -> None:
+        with self._lock:
+            self._items.pop((pwd, salt), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+
+key_cache = _KeyCache()
 
 
 def _derive_key(pwd: str, salt: bytes) -> bytes:
-    return hashlib.pbkdf2_hmac("sha256", pwd.encode(), salt, 100_000)
+    return hashlib.pbkdf2_hmac("sha256", pwd.encode(), salt, KDF_ITERATIONS)
+
+
+def _cached_key(pwd: str, salt: bytes) -> bytes:
+    derived = key_cache.get(pwd, salt)
+    if derived is None:
+        derived = _derive_key(pwd, salt)
+        key_cache.put(pwd, salt, derived)
+    return derived
+
+
+def _fernet_for(pwd: str, salt: bytes) -> Fernet:
+    return Fernet(base64.urlsafe_b64encode(_cached_key(pwd, salt)))
+
+
+def _subkey(derived: bytes, label: bytes) -> bytes:
+    # independent keys for the newer formats, without another PBKDF2 run
+    return hmac.new(derived, label, "sha256").digest()
+
+
+def _session_salt(sid: str) -> bytes:
+    # every participant of a session derives the same salt, so one PBKDF2 run
+    # per session yields a key that decrypts everybody's v1 payloads
+    return hashlib.sha256(b"stealthchat/session/" + sid.encode()).digest()[:SALT_LEN]
+
+
+def _is_v1(cipher: bytes) -> bool:
+    return cipher[:3] == WIRE_V1 and cipher[3 + SALT_LEN:4 + SALT_LEN] == b"g"
 
 
 def encrypt_message(plain: str, pwd: str) -> bytes:
-    salt = os.urandom(16)
+    """Legacy format: fresh salt and a full PBKDF2 derivation per message."""
+    salt = os.urandom(SALT_LEN)
     key = base64.urlsafe_b64encode(_derive_key(pwd, salt))
     return salt + Fernet(key).encrypt(plain.encode())
 
 
 def decrypt_message(cipher: bytes, pwd: str) -> str:
-    salt, token = cipher[:16], cipher[16:]
-    key = base64.urlsafe_b64encode(_derive_key(pwd, salt))
-    return Fernet(key).decrypt(token).decode()
+    """Decrypt a v1 or legacy payload; derived keys are cached per salt."""
+    if _is_v1(cipher):
+        salt, token = cipher[3:3 + SALT_LEN], cipher[3 + SALT_LEN:]
+    else:
+        salt, token = cipher[:SALT_LEN], cipher[SALT_LEN:]
+    return _fernet_for(pwd, salt).decrypt(token).decode()
+
+
+def encrypt_session_message(sid: str, plain: str) -> bytes:
+    """v1 format using the key derived once in init_session()."""
+    sk = session_keys[sid]
+    return WIRE_V1 + sk.salt + sk.fernet.encrypt(plain.encode())
+
+
+def decrypt_session_message(sid: str, cipher: bytes) -> str:
+    sk = session_keys.get(sid)
+    if sk and _is_v1(cipher):
+        # v1 salts come from the sid: any other salt was never meant for us
+        if cipher[3:3 + SALT_LEN] != sk.salt: raise KeyMismatch(sid)
+        return sk.fernet.decrypt(cipher[3 + SALT_LEN:]).decode()
+    return decrypt_message(cipher, session_passwords[sid])
+
+
+def encrypt_compact(sid: str, plain: str) -> bytes:
+    """v2: AES-GCM over the (zlib-compressed, if that helps) plaintext."""
+    sk = session_keys[sid]
+    body, flags = plain.encode(), V2_KID
+    packed = zlib.compress(body, 9)
+    if len(packed) < len(body):
+        body, flags = packed, flags | V2_ZLIB
+    header = bytes((WIRE_V2, flags))
+    nonce = sk.kid + os.urandom(NONCE_LEN - KID_LEN)
+    return header + nonce + sk.aead.encrypt(nonce, body, header)
+
+
+def decrypt_compact(sid: str, cipher: bytes) -> str:
+    header, nonce, sealed = cipher[:2], cipher[2:2 + NONCE_LEN], cipher[2 + NONCE_LEN:]
+    if header[0] != WIRE_V2:
+        raise ValueError(f"unknown wire version {header[0]}")
+    sk = session_keys[sid]
+    if header[1] & V2_KID and nonce[:KID_LEN] != sk.kid:
+        raise KeyMismatch(sid)
+    body = sk.aead.decrypt(nonce, sealed, header)
+    if header[1] & V2_ZLIB:
+        body = zlib.decompress(body)
+    return body.decode()
+
+
+def encode_session_message(sid: str, plain: str, version: int = WIRE_V2) -> str:
+    """Encrypt and text-encode <plain> for the wire in the given format version."""
+    if version >= WIRE_V2:
+        return V2_PREFIX + base64.b85encode(encrypt_compact(sid, plain)).decode()
+    return base64.urlsafe_b64encode(encrypt_session_message(sid, plain)).decode()
+
+
+def decode_session_message(sid: str, text: str) -> str:
+    """Inverse of encode_session_message; the version is detected from the text."""
+    if text.startswith(V2_PREFIX):
+        return decrypt_compact(sid, base64.b85decode(text[len(V2_PREFIX):]))
+    return decrypt_session_message(sid, base64.urlsafe_b64decode(text.encode()))
+
+
+def peek_key_id(text: str) -> Optional[bytes]:
+    """The key id of a v2 payload, from its first few characters; None if it has none."""
+    if not text.startswith(V2_PREFIX): return None
+    try: head = base64.b85decode(text[len(V2_PREFIX):len(V2_PREFIX) + 10])
+    except ValueError: return None
+    if len(head) < 2 + KID_LEN or head[0] != WIRE_V2 or not head[1] & V2_KID: return None
+    return head[2:2 + KID_LEN]
+
+
+def needs_kdf(text: str) -> bool:
+    """True if decoding <text> runs PBKDF2: a legacy payload with its own salt."""
+    if text.startswith(V2_PREFIX): return False
+    try: cipher = base64.urlsafe_b64decode(text.encode())
+    except ValueError: return False             # rejected before any key work
+    return not _is_v1(cipher)
+
+
+def key_id(sid: str) -> Optional[bytes]:
+    sk = session_keys.get(sid)
+    return sk.kid if sk else None
+
+
+class StreamEncryptor:
+    """Chunked encryption with the session's stream key; memory stays at one chunk."""
+
+    def __init__(self, sid: str):
+        self._aead = session_keys[sid].stream
+        self._prefix = os.urandom(STREAM_PREFIX_LEN)
+        self._buf = bytearray()
+        self._counter = 0
+        self._started = False
+
+    def _seal(self, chunk: bytes, last: bool) -> bytes:
+        nonce = self._prefix + self._counter.to_bytes(4, "big") + bytes((last,))
+        self._counter += 1
+        return self._aead.encrypt(nonce, chunk, None)
+
+    def _header(self) -> bytes:
+        if self._started: return b""
+        self._started = True
+        return STREAM_MAGIC + self._prefix
+
+    def update(self, data: bytes) -> bytes:
+        self._buf += data
+        out = [self._header()]
+        # keep at least one byte back so finalize() always has the last chunk
+        while len(self._buf) > STREAM_CHUNK:
+            out.append(self._seal(bytes(self._buf[:STREAM_CHUNK]), False))
+            del self._buf[:STREAM_CHUNK]
+        return b"".join(out)
+
+    def finalize(self) -> bytes:
+        head = self._header()
+        last, self._buf = bytes(self._buf), bytearray()
+        return head + self._seal(last, True)
+
+
+class StreamDecryptor:
+    """Inverse of StreamEncryptor; feed ciphertext as it downloads."""
+
+    def __init__(self, sid: str):
+        self._aead = session_keys[sid].stream
+        self._prefix: Optional[bytes] = None
+        self._buf = bytearray()
+        self._counter = 0
+
+    def _open(self, chunk: bytes, last: bool) -> bytes:
+        assert self._prefix is not None
+        nonce = self._prefix + self._counter.to_bytes(4, "big") + bytes((last,))
+        self._counter += 1
+        return self._aead.decrypt(nonce, chunk, None)
+
+    def update(self, data: bytes) -> bytes:
+        self._buf += data
+        if self._prefix is None:
+            head = len(STREAM_MAGIC) + STREAM_PREFIX_LEN
+            if len(self._buf) < head: return b""
+            if bytes(self._buf[:len(STREAM_MAGIC)]) != STREAM_MAGIC:
+                raise ValueError("not a StealthChat stream")
+            self._prefix = bytes(self._buf[len(STREAM_MAGIC):head])
+            del self._buf[:head]
+        out = []
+        sealed = STREAM_CHUNK + STREAM_TAG
+        # a full-size chunk might still be the last one: hold it until more arrives
+        while len(self._buf) > sealed:
+            out.append(self._open(bytes(self._buf[:sealed]), False))
+            del self._buf[:sealed]
+        return b"".join(out)
+
+    def finalize(self) -> bytes:
+        if self._prefix is None:
+            raise ValueError("truncated stream")
+        last, self._buf = bytes(self._buf), bytearray()
+        return self._open(last, True)
+
+
+def _worker_session(sid: str, pwd: str) -> None:
+    # pool entry points: child processes don't share our session state, so
+    # they derive (once) on demand; threads must not resurrect a cleared sid
+    if multiprocessing.parent_process() is None:
+        if sid not in session_keys:
+            raise KeyError(sid)
+    elif session_passwords.get(sid) != pwd:
+        init_session(sid, pwd)
+
+
+def worker_encode(sid: str, pwd: str, plain: str, version: int = WIRE_V2) -> str:
+    _worker_session(sid, pwd)
+    return encode_session_message(sid, plain, version)
+
+
+def worker_decode(sid: str, pwd: str, text: str) -> str:
+    _worker_session(sid, pwd)
+    return decode_session_message(sid, text)
 
 
 def init_session(sid: str, pwd: str) -> None:
     session_passwords[sid] = pwd
+    salt = _session_salt(sid)
+    derived = _cached_key(pwd, salt)
+    session_keys[sid] = SessionKey(salt, Fernet(base64.urlsafe_b64encode(derived)),
+                                   AESGCM(_subkey(derived, b"stealthchat/v2/aead")),
+                                   AESGCM(_subkey(derived, b"stealthchat/stream")),
+                                   _subkey(derived, b"stealthchat/kid")[:KID_LEN])
 
 
 def clear_session(sid: str) -> None:
-    session_passwords.pop(sid, None)
+    pwd = session_passwords.pop(sid, None)
+    session_keys.pop(sid, None)
+    if pwd is not None: key_cache.discard(pwd, _session_salt(sid))   # leaving drops the key
@@ -0,0 +1,302 @@
+# fakediscord.py — in-process stand-in for the Discord surfaces chat.py uses
+
+import asyncio, os, threading, time, types
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Optional
+
+import discord
+
+FAKE_HOOK = "https://fake.invalid/api/webhooks/{}/fake"
+
+
+def _http_error(cls, status: int, reason: str) -> discord.HTTPException:
+    return cls(types.SimpleNamespace(status=status, reason=reason), reason)
+
+
+def _throttle(world: "FakeDiscord", limit: Optional[tuple], sent: Deque[float]) -> None:
+    if not limit: return
+    now = time.monotonic()
+    while sent and now - sent[0] >= limit[1]: sent.popleft()
+    if len(sent) >= limit[0]:
+        world.calls["429"] += 1
+        raise _http_error(discord.HTTPException, 429, "You are being rate limited.")
+    sent.append(now)
+
+
+class FakeMessage:
+    def __init__(self, world: "FakeDiscord", channel: "FakeTextChannel", content: str,
+                 author: Any = None, webhook_id: Optional[int] = None, attachment: Optional[bytes] = None):
+        self.id          = world.snowflake()
+        self.channel     = channel
+        self.content     = content
+        self.author      = author
+        self.webhook_id  = webhook_id
+        self.attachments = []
+        if attachment is not None:
+            url = f"fake://attachments/{self.id}"
+            world.attachments[url] = attachment
+            self.attachments.append(types.SimpleNamespace(url=url, size=len(attachment)))
+
+
+class FakeTextChannel(discord.TextChannel):
+    """Enough of discord.TextChannel for chat.py (isinstance checks still pass)."""
+
+    def __init__(self, world: "FakeDiscord", guild: "FakeGuild", ch_id: int, name: str):
+        self.world, self.guild, self.id, self.name = world, guild, ch_id, name
+        self.messages: List[FakeMessage] = []
+        self.sent: Deque[float] = deque()          # send times, for the per-channel limit
+        self.hooks: List["FakeWebhook"] = []
+        self.hook_sent: Deque[float] = deque()     # webhook sends, for their per-channel limit
+
+    @property
+    def last_message_id(self) -> Optional[int]:   # Discord sends this with the guild payload
+        return self.messages[-1].id if self.messages else None
+
+    async def send(self, content: Optional[str] = None, *, file: Optional[discord.File] = None, **kw):
+        await self.world.api("send")
+        self._rate_limit()
+        data = file.fp.read() if file is not None else None
+        msg  = FakeMessage(self.world, self, content or "", self.world.bot.user, attachment=data)
+        self.messages.append(msg)
+        self.world.dispatch("message", msg)
+        return msg
+
+    def _rate_limit(self) -> None:
+        _throttle(self.world, self.world.rate_limit, self.sent)
+
+    async def webhooks(self) -> List["FakeWebhook"]:
+        await self.world.api("webhooks")
+        return list(self.hooks)
+
+    async def create_webhook(self, *, name: str, **kw) -> "FakeWebhook":
+        await self.world.api("create_webhook")
+        hook = FakeWebhook(self.world, self, name=name, hook_id=self.world.snowflake())
+        self.hooks.append(hook); self.world.hooks_by_id[hook.id] = hook
+        return hook
+
+    async def history(self, limit: Optional[int] = 100, before: Any = None, after: Any = None,
+                      oldest_first: Optional[bool] = None):
+        await self.world.api("history")
+        msgs = [m for m in self.messages if (after is None or m.id > after.id)
+                and (before is None or m.id < before.id)]
+        if not (oldest_first or (oldest_first is None and after is not None)):
+            msgs.reverse()
+        for i, m in enumerate(msgs[:limit] if limit else msgs):
+            if i and i % 100 == 0: await self.world.api("history")   # one request per page
+            yield m
+
+    async def purge(self, limit: Optional[int] = 100, **kw) -> List[FakeMessage]:
+        await self.world.api("purge")
+        gone, self.messages = self.messages, []
+        return gone
+
+    async def edit(self, *, name: Optional[str] = None, **kw) -> "FakeTextChannel":
+        await self.world.api("edit_channel")
+        if name is not None and name != self.name:
+            before = types.SimpleNamespace(id=self.id, name=self.name)
+            self.name = name
+            self.world.dispatch("guild_channel_update", before, self)
+        return self
+
+    async def delete(self, **kw) -> None:
+        await self.world.api("delete_channel")
+        if self in self.guild.text_channels:
+            self.guild.text_channels.remove(self)
+            self.world.dispatch("guild_channel_delete", self)
+
+
+class FakeGuild:
+    def __init__(self, world: "FakeDiscord", guild_id: int):
+        self.world, self.id = world, guild_id
+        self.text_channels: List[FakeTextChannel] = []
+
+    @property
+    def channels(self) -> List[FakeTextChannel]:
+        return self.text_channels
+
+    def get_channel(self, ch_id: int) -> Optional[FakeTextChannel]:
+        return next((c for c in self.text_channels if c.id == ch_id), None)
+
+    def add_channel(self, name: str, ch_id: Optional[int] = None) -> FakeTextChannel:
+        ch = FakeTextChannel(self.world, self, ch_id or self.world.snowflake(), name)
+        self.text_channels.append(ch)
+        return ch
+
+    async def create_text_channel(self, name: str, **kw) -> FakeTextChannel:
+        await self.world.api("create_channel")
+        return self.add_channel(name)
+
+
+class FakeWebhook:
+    def __init__(self, world: "FakeDiscord", channel: FakeTextChannel, name: str = "counter",
+                 hook_id: Optional[int] = None):
+        self.world, self.channel, self.id = world, channel, hook_id or channel.id
+        self.name, self.token, self.user = name, f"token{self.id}", world.bot.user
+
+    def _find(self, message_id: int) -> FakeMessage:
+        for m in self.channel.messages:
+            if m.id == message_id: return m
+        raise _http_error(discord.NotFound, 404, "Unknown Message")
+
+    async def send(self, content: str, *, wait: bool = False, file: Optional[discord.File] = None,
+                   **kw) -> FakeMessage:
+        await self.world.api("webhook_send")
+        _throttle(self.world, self.world.hook_rate_limit, self.channel.hook_sent)
+        data = file.fp.read() if file is not None else None
+        msg  = FakeMessage(self.world, self.channel, content, types.SimpleNamespace(id=self.id, name=self.name),
+                           webhook_id=self.id, attachment=data)
+        self.channel.messages.append(msg)
+        self.world.dispatch("message", msg)
+        return msg
+
+    async def fetch_message(self, message_id: int) -> FakeMessage:
+        await self.world.api("webhook_fetch")
+        return self._find(message_id)
+
+    async def edit_message(self, message_id: int, *, content: Optional[str] = None, **kw) -> FakeMessage:
+        await self.world.api("webhook_edit")
+        msg = self._find(message_id)
+        if content is not None: msg.content = content
+        self.world.dispatch("raw_message_edit", types.SimpleNamespace(
+            channel_id=self.channel.id, message_id=msg.id,
+            data={"content": msg.content, "webhook_id": str(self.id)}))
+        return msg
+
+    async def delete_message(self, message_id: int, **kw) -> None:
+        await self.world.api("webhook_delete")
+        self.channel.messages.remove(self._find(message_id))
+        self.world.dispatch("raw_message_delete", types.SimpleNamespace(
+            channel_id=self.channel.id, message_id=message_id))
+
+
+class FakeBot:
+    """Replaces chat.bot: owns the event loop and hands events to chat's handlers."""
+
+    def __init__(self, world: "FakeDiscord"):
+        self.world  = world
+        self.user   = types.SimpleNamespace(id=world.snowflake(), name="StealthChat")
+        self.guilds: List[FakeGuild] = []
+        self.loop:  Optional[asyncio.AbstractEventLoop] = None
+        self._ready = threading.Event()
+
+    def get_guild(self, guild_id: int) -> Optional[FakeGuild]:
+        return next((g for g in self.guilds if g.id == guild_id), None)
+
+    def get_channel(self, ch_id: int) -> Optional[FakeTextChannel]:
+        for g in self.guilds:
+            ch = g.get_channel(ch_id)
+            if ch is not None: return ch
+        return None
+
+    async def fetch_channel(self, ch_id: int) -> FakeTextChannel:
+        await self.world.api("fetch_channel")
+        ch = self.get_channel(ch_id)
+        if ch is None: raise _http_error(discord.NotFound, 404, "Unknown Channel")
+        return ch
+
+    async def process_commands(self, msg: Any) -> None: pass
+
+    async def wait_until_ready(self) -> None:
+        while not self._ready.is_set(): await asyncio.sleep(0.01)
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def run(self, token: Optional[str] = None) -> None:
+        """Blocking, like discord.py's: connect, fire on_ready, serve until close()."""
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.world.handler("ready")())
+        self._ready.set()
+        self.loop.run_forever()
+
+    def close(self) -> None:
+        if self.loop is None: return
+        async def shutdown():
+            for http in (self.world.chat.http_session, self.world.chat.hook_http):
+                if http is not None: await http.close()
+            self.loop.stop()
+        asyncio.run_coroutine_threadsafe(shutdown(), self.loop)
+
+
+class FakeDiscord:
+    """A whole fake Discord: guilds, channels, webhooks and API call accounting.
+
+    <latency> is added to every API call; <rate_limit> is (messages, seconds)
+    per channel, over which sends fail with 429 like the real thing, and
+    <hook_rate_limit> the same for webhook sends in a channel. Attachment
+    bytes are kept in <attachments> by URL but are not served over HTTP.
+    """
+
+    def __init__(self, chat_module: Any, latency: float = 0.0, rate_limit: Optional[tuple] = (5, 5.0),
+                 hook_rate_limit: Optional[tuple] = (30, 60.0)):
+        self.chat        = chat_module
+        self.latency     = latency
+        self.rate_limit  = rate_limit
+        self.hook_rate_limit = hook_rate_limit
+        self.calls: Dict[str, int] = {"429": 0}
+        self.attachments: Dict[str, bytes] = {}
+        self._last_id    = 0
+        self.bot         = FakeBot(self)
+        self.hooks: Dict[str, FakeWebhook] = {}    # counter webhooks by URL
+        self.hooks_by_id: Dict[int, FakeWebhook] = {}
+
+    def snowflake(self) -> int:
+        # time-based like Discord's, so history cursors and horizons line up
+        self._last_id = max(self._last_id + 1, discord.utils.time_snowflake(datetime.now(timezone.utc)))
+        return self._last_id
+
+    async def api(self, name: str) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency: await asyncio.sleep(self.latency)
+
+    def handler(self, event: str):
+        return getattr(self.chat, f"on_{event}", None)
+
+    def dispatch(self, event: str, *args) -> None:
+        handler = self.handler(event)
+        if handler is not None and self.bot.loop is not None:
+            self.bot.loop.create_task(handler(*args))
+
+    def guild(self, guild_id: int) -> FakeGuild:
+        g = self.bot.get_guild(guild_id)
+        if g is None:
+            g = FakeGuild(self, guild_id); self.bot.guilds.append(g)
+        return g
+
+    def webhook_from_url(self, url: str, session: Any = None) -> FakeWebhook:
+        return self.hooks[url]
+
+    def webhook_partial(self, hook_id: int, token: str, session: Any = None) -> FakeWebhook:
+        return self.hooks_by_id[hook_id]
+
+    def api_calls(self) -> int:
+        return sum(n for k, n in self.calls.items() if k != "429")
+
+
+def install(guilds: int = 1, latency: float = 0.0, rate_limit: Optional[tuple] = (5, 5.0),
+            hook_rate_limit: Optional[tuple] = (30, 60.0)) -> FakeDiscord:
+    """Import chat.py wired to a fresh FakeDiscord with one guild per shard.
+
+    Call before anything else imports chat; <guilds> only applies when no
+    SHARDS/SESSIONS_CHANNEL_ID configuration is present in the environment.
+    """
+    os.environ.setdefault("BOT_TOKEN", "fake")
+    os.environ.setdefault("STATE_DB", "")
+    if guilds > 1:
+        os.environ.setdefault("SHARDS", ";".join(
+            f"{100 + i},{200 + i},{FAKE_HOOK.format(200 + i)}" for i in range(guilds)))
+    os.environ.setdefault("SESSIONS_CHANNEL_ID", "200")
+    os.environ.setdefault("WEBHOOK_URL", FAKE_HOOK.format(200))
+    import chat
+
+    world = FakeDiscord(chat, latency, rate_limit, hook_rate_limit)
+    for i, shard in enumerate(chat.shards):
+        guild = world.guild(shard.guild_id or 100 + i)
+        shard.guild_id = guild.id                   # what on_ready's first sync resolves
+        sessions = guild.add_channel("active-sessions", shard.sessions_channel_id)
+        world.hooks[shard.webhook_url] = FakeWebhook(world, sessions)
+    chat.bot     = world.bot
+    chat.Webhook = types.SimpleNamespace(from_url=world.webhook_from_url, partial=world.webhook_partial)
+    return world
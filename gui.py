@@ -1,171 +1,389 @@
 # gui.py — StealthChat GUI for the user-count backend
 
-import os, threading, asyncio, base64, tkinter as tk
-from typing import Callable, Optional
-from dotenv import load_dotenv
-from PIL import Image, ImageGrab, ImageFile
-import PIL.Image
-import io
-import requests
 import time
+_T0 = time.perf_counter()                   # startup timings are measured from here
+
+import json, os, threading, queue, tkinter as tk
+from tkinter import ttk
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from dotenv import load_dotenv
 import random
 
-import crypter
-from chat import (
-    bot, session_counts,
-    start_auto_session_from_thread, join_session_from_thread,
-    leave_session_from_thread, send_session_message_from_thread,
-    register_receive_callback, unregister_receive_callback,
-    sync_active_sessions,
-)
+# chat.py (discord.py, aiohttp, cryptography) loads on a worker thread once the
+# window is up; images.py (PIL, requests) on the first image. See _load_backend().
+chat:    Any = None
+crypter: Any = None
 
-# ─── env / bot thread ───────────────────────────────────────────────────
+# ─── env ────────────────────────────────────────────────────────────────
 load_dotenv()
-IMGBB_API_KEY = os.environ["IMGBB_API_KEY"]
-BOT_TOKEN = os.environ["BOT_TOKEN"]; GUILD_ID = int(os.environ["GUILD_ID"])
-threading.Thread(target=lambda: bot.run(BOT_TOKEN), daemon=True).start()
+STARTUP_REPORT = os.environ.get("STARTUP_REPORT", "")   # append startup timings (JSON lines)
 
 # ─── Tk basics ──────────────────────────────────────────────────────────
 root = tk.Tk(); root.title("StealthChat GUI")
 root.geometry("600x500"); root.configure(bg="#000"); root.resizable(False, False)
 FONT = ("Consolas", 12); TX_BG, TX_FG = "#000", "#0f0"
 
-current_session: Optional[str] = None
-_my_receive_cb: Optional[Callable[[str], None]] = None
-user_name: str
+tabs: Dict[str, "SessionTab"] = {}         # SID → open chat tab (one bot serves them all)
+notebook: Optional[ttk.Notebook] = None     # the chat view, once a session is open
 
 frame = tk.Frame(root, bg=TX_BG); frame.pack(fill="both", expand=True)
 
+# ─── Tk ⇄ bot-loop bridge ───────────────────────────────────────────────
+# Widgets are only touched from the Tk thread: bot-loop results and inbound
+# messages are queued here and drained once per frame by _pump().
+FRAME_MS        = 16
+INBOX_PER_FRAME = 200
+_ui_calls: "queue.Queue[Callable[[], None]]" = queue.Queue()
+_inbox:    "queue.Queue[Tuple[str, str]]"    = queue.Queue()
+_inbox_handlers: Dict[str, Callable[[List[str]], None]] = {}
+
+def on_future_done(fut: Future, ok: Callable, fail: Optional[Callable] = None) -> None:
+    """Run ok(result) / fail(exc) on the Tk thread once <fut> completes."""
+    def done(f: Future):
+        try: res = f.result()
+        except Exception as e:
+            if fail: _ui_calls.put(lambda e=e: fail(e))     # "e" is unbound after except
+            return
+        _ui_calls.put(lambda: ok(res))
+    fut.add_done_callback(done)
+
+def inbox_callback(sid: str) -> Callable[[str], None]:
+    """Receive callback for chat.py: runs on the bot loop, so it only enqueues."""
+    return lambda msg: _inbox.put((sid, msg))
+
+def _pump():
+    # one failing callback must not stop the pump: log it and keep draining
+    try:
+        while True:
+            try: fn = _ui_calls.get_nowait()
+            except queue.Empty: break
+            try: fn()
+            except Exception as e: print(f"[GUI] callback error: {e!r}")
+        batches: Dict[str, List[str]] = {}
+        for _ in range(INBOX_PER_FRAME):
+            try: sid, msg = _inbox.get_nowait()
+            except queue.Empty: break
+            batches.setdefault(sid, []).append(msg)
+        for sid, msgs in batches.items():
+            handler = _inbox_handlers.get(sid)
+            if not handler: continue
+            try: handler(msgs)
+            except Exception as e: print(f"[GUI] {sid}: inbox handler error: {e!r}")
+    finally:
+        root.after(FRAME_MS, _pump)
+
 def clear_frame(): [c.destroy() for c in frame.winfo_children()]
 
 def on_close():
-    if current_session and _my_receive_cb:
-        pwd = crypter.session_passwords.get(current_session)
-        if pwd:
-            payload = f"System:{user_name} has left the session"
-            enc     = crypter.encrypt_message(payload, pwd)
-            send_session_message_from_thread(
-                current_session, base64.urlsafe_b64encode(enc).decode())
-        unregister_receive_callback(current_session, _my_receive_cb)
-        leave_session_from_thread(current_session)
+    if chat is None: root.destroy(); return     # closed before the backend loaded
+    for left in [tab.leave() for tab in list(tabs.values())]:
+        try: left.result(5)                 # goodbyes out before the channels can go
+        except Exception: pass
+    try: chat.drain_pool_from_thread()      # don't leave spare channels behind
+    except Exception: pass
     root.destroy()
 
 root.protocol("WM_DELETE_WINDOW", on_close)
 
 
-def upload_clipboard_image() -> Optional[str]:
+# ─── staged startup ─────────────────────────────────────────────────────
+startup: Dict[str, float] = {}              # stage → seconds since _T0
+backend_ready = threading.Event()           # bot connected and sessions synced
+backend_error: Optional[str] = None
+_backend_listener: Optional[Callable[[], None]] = None  # Tk-thread hook of the visible screen
+
+def _mark(stage: str) -> None:
+    startup[stage] = time.perf_counter() - _T0
+
+def _report_startup() -> None:
+    print("[STARTUP] " + "  ".join(f"{k} {v:.2f}s" for k, v in startup.items()))
+    if STARTUP_REPORT:
+        with open(STARTUP_REPORT, "a") as f:
+            f.write(json.dumps({"time": time.time(), "stages": startup}) + "\n")
+
+def _backend_changed(error: Optional[str] = None) -> None:
+    global backend_error
+    if error: backend_error = error
+    if _backend_listener: _backend_listener()
+
+def _load_backend() -> None:
+    """Worker thread: import chat.py, run the bot on its own thread, then flag readiness."""
+    global chat, crypter
+    try:
+        import chat as _chat, crypter as _crypter, metrics
+    except Exception as e:
+        err = f"Backend failed to load: {e}"
+        _ui_calls.put(lambda: _backend_changed(err)); return
+    chat, crypter = _chat, _crypter
+    _mark("backend")
+    metrics.gauge("gui_startup_seconds", lambda: dict(startup), "stage",
+                  "GUI startup stages, seconds after launch")
+
+    def run_bot():
+        try: chat.bot.run(chat.BOT_TOKEN)
+        except Exception as e:
+            err = f"Bot stopped: {e}"
+            _ui_calls.put(lambda: _backend_changed(err))
+    threading.Thread(target=run_bot, daemon=True).start()
+    chat.ready.wait()
+    _mark("ready")
+    backend_ready.set()
+    _report_startup()
+    _ui_calls.put(_backend_changed)
+
+
+def grab_clipboard_image() -> Optional[Any]:   # PIL.Image.Image; PIL loads lazily
+    """Clipboard image (direct bitmap or first copied file), else None."""
+    from PIL import Image, ImageGrab
     try:
         raw = ImageGrab.grabclipboard()
-        img: Optional[PIL.Image.Image] = None  # Explicit type hint
+        if isinstance(raw, Image.Image):
+            return raw
+        if isinstance(raw, list) and len(raw) > 0:
+            return Image.open(raw[0])
+    except Exception as e:
+        print(f"[grab_clipboard_image] error: {e}")
+    return None
 
-        # Case 1: direct image object
-        if isinstance(raw, PIL.Image.Image):
-            img = raw
 
-        # Case 2: file list
-        elif isinstance(raw, list) and len(raw) > 0:
-            try:
-                img = Image.open(raw[0])
-            except Exception:
-                return None
+def _images() -> Any:
+    """images.py, imported on first use (it pulls in PIL and requests)."""
+    import images
+    return images
 
-        if img is None:
-            return None
 
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        buf.seek(0)
-        b64 = base64.b64encode(buf.read()).decode()
+# ───────────────────────── scrollback ───────────────────────────────────
+SCROLLBACK_LINES = 500          # entries kept in the chat box
+LIVE_IMAGES      = 20           # newest images kept decoded; older ones collapse to text
+LINE_TTL         = 600          # seconds before a line self-destructs
 
-        resp = requests.post("https://api.imgbb.com/1/upload", data={
-            "key": IMGBB_API_KEY,
-            "image": b64,
-            "expiration": 600
-        })
+class _Entry:
+    __slots__ = ("tag", "expires", "image")
 
-        if resp.status_code == 200:
-            return resp.json()["data"]["url"]
-        return None
+    def __init__(self, tag: str, expires: float, image: Optional[tk.Label]):
+        self.tag, self.expires, self.image = tag, expires, image
 
-    except Exception as e:
-        print(f"[upload_clipboard_image] error: {e}")
-        return None
-    try:
-        raw = ImageGrab.grabclipboard()
-        img = None
-
-        # Case 1: direct image object
-        if hasattr(raw, "save"):
-            img = raw
-
-        # Case 2: list of file paths
-        elif isinstance(raw, list) and len(raw) > 0:
-            from PIL import Image
-            try:
-                img = Image.open(raw[0])
-            except Exception:
-                pass  # fail silently
-
-        if img is None:
-            return None  # no image found
-
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        buf.seek(0)
-        b64 = base64.b64encode(buf.read()).decode()
-
-        resp = requests.post("https://api.imgbb.com/1/upload", data={
-            "key": IMGBB_API_KEY,
-            "image": b64,
-            "expiration": 600
-        })
-
-        if resp.status_code == 200:
-            return resp.json()["data"]["url"]
-        return None
+class Scrollback:
+    """Bounded chat log over a tk.Text.
 
-    except Exception as e:
-        print(f"[ERROR] upload_clipboard_image(): {e}")
-        return None
-
-    try:
-        raw = ImageGrab.grabclipboard()
+    Entries live in a ring (oldest first) and expire in order from a single
+    after() timer; tag names are recycled; image labels are destroyed when
+    their entry goes, and collapsed to a placeholder once LIVE_IMAGES newer
+    images exist. History goes in above everything, only while there is room.
+    """
 
-        # Case 1: it's a direct image object (from screenshot tools, etc.)
-        if hasattr(raw, "save"):
-            img = raw
-
-        # Case 2: it's a file path list like ["C:/Users/Kfir/Desktop/pic.png"]
-        elif isinstance(raw, list) and len(raw) > 0:
-            try:
-                from PIL import Image
-                img = Image.open(raw[0])
-            except Exception:
-                return None
+    def __init__(self, text: tk.Text):
+        self.text = text
+        self.entries: Deque[_Entry] = deque()
+        self.images:  Deque[_Entry] = deque()       # entries still holding a live label
+        self.free_tags: List[str] = []
+        self.next_tag = 0
+        self.timer: Optional[str] = None
+
+    def _tag(self) -> str:
+        if self.free_tags: return self.free_tags.pop()
+        self.next_tag += 1
+        return f"line{self.next_tag}"
+
+    def _insert(self, fill: Callable[[str], None], ttl: float, image: Optional[tk.Label],
+                old: bool = False) -> bool:
+        """Add an entry at the bottom, or above everything if <old> (history)."""
+        if old and len(self.entries) >= SCROLLBACK_LINES: return False
+        tag = self._tag()
+        self.text.config(state="normal")
+        view = self.text.yview()
+        anchor = self.text.index("@0,0")
+        if old:
+            self.text.mark_set("sb_top", "1.0"); self.text.mark_gravity("sb_top", "right")
+            fill("sb_top")
+            self.text.tag_add(tag, "1.0", "sb_top")
+        else:
+            start = self.text.index("end-1c")
+            fill("end")
+            self.text.tag_add(tag, start, "end-1c")
+        entry = _Entry(tag, time.monotonic() + ttl, image)
+        if old:
+            self.entries.appendleft(entry)
+            if image is not None: self.images.appendleft(entry)
         else:
-            return None
+            self.entries.append(entry)
+            if image is not None: self.images.append(entry)
+            while len(self.entries) > SCROLLBACK_LINES: self._drop(self.entries.popleft())
+        while len(self.images) > LIVE_IMAGES: self._collapse(self.images.popleft())
+        self.text.config(state="disabled")
+        if not old:
+            self.text.see("end")
+        elif view != (0.0, 1.0):                    # keep the lines being read in place
+            added = int(self.text.index("sb_top").split(".")[0]) - 1
+            line, col = anchor.split(".")
+            self.text.yview(f"{int(line) + added}.{col}")
+        if old and self.timer is not None:          # history expires before anything shown
+            self.text.after_cancel(self.timer); self.timer = None
+        self._arm()
+        return True
+
+    def add(self, line: str, ttl: float = LINE_TTL, old: bool = False) -> bool:
+        return self._insert(lambda at: self.text.insert(at, line + "\n"), ttl, None, old)
+
+    def add_image(self, ttl: float = LINE_TTL, old: bool = False) -> Optional[tk.Label]:
+        if old and len(self.entries) >= SCROLLBACK_LINES: return None
+        label = tk.Label(self.text, text="[loading image…]", fg=TX_FG, bg=TX_BG, font=FONT)
+        def fill(at: str):
+            self.text.insert(at, "\n")
+            self.text.window_create(at, window=label)
+            self.text.insert(at, "\n\n")
+        self._insert(fill, ttl, label, old)
+        return label
+
+    @staticmethod
+    def _release(label: tk.Label) -> None:
+        setattr(label, "image", None)               # drop the PhotoImage
+        if label.winfo_exists(): label.destroy()
+
+    def _collapse(self, entry: _Entry) -> None:
+        if entry.image is None: return
+        label, entry.image = entry.image, None
+        try:
+            at = self.text.index(str(label))
+            self.text.delete(at)
+            self.text.insert(at, "[image]", entry.tag)
+        except tk.TclError: pass
+        self._release(label)
+
+    def _drop(self, entry: _Entry) -> None:
+        if self.text.tag_ranges(entry.tag):
+            self.text.delete(f"{entry.tag}.first", f"{entry.tag}.last")
+        if entry.image is not None:
+            if entry in self.images: self.images.remove(entry)
+            self._release(entry.image)
+        self.free_tags.append(entry.tag)
+
+    def _arm(self) -> None:
+        if self.timer is not None or not self.entries: return
+        delay = max(0, int((self.entries[0].expires - time.monotonic()) * 1000))
+        self.timer = self.text.after(delay, self._expire)
+
+    def _expire(self) -> None:
+        self.timer = None
+        if not self.text.winfo_exists(): return
+        now = time.monotonic()
+        self.text.config(state="normal")
+        while self.entries and self.entries[0].expires <= now:
+            self._drop(self.entries.popleft())
+        self.text.config(state="disabled")
+        self._arm()
+
+
+# ───────────────────────── matrix rain ──────────────────────────────────
+MATRIX_CHARS    = "01ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+MATRIX_TRAIL    = 12            # glyphs per column, head included
+MATRIX_STEP     = 15            # px a head falls per frame
+MATRIX_FRAME_MS = 75            # fastest frame interval
+MATRIX_BUDGET   = 0.10          # share of Tk-thread time the effect may use
+MATRIX_IDLE_MS  = 300           # focus poll interval while paused
+
+class MatrixRain:
+    """Connect-screen rain drawn with a fixed set of canvas items.
+
+    Every column owns MATRIX_TRAIL text items, created once and used as a
+    ring: each frame the oldest becomes the new head (one coords and one
+    text change). All columns advance together, so an item's age follows
+    from its ring slot and one itemconfig per slot recolours every trail.
+    """
 
-        # save to buffer
-        buf = io.BytesIO()
-        img.save(buf, format="PNG")
-        buf.seek(0)
-        b64 = base64.b64encode(buf.read()).decode()
+    def __init__(self, canvas: tk.Canvas, xs: List[int], height: int):
+        self.canvas, self.xs, self.height = canvas, xs, height
+        self.colors = ["#0f0"] + [f"#00{max(0, 15 - i * 2):02x}00" for i in range(1, MATRIX_TRAIL)]
+        self.heads  = [random.randint(-500, 0) for _ in xs]
+        self.items  = [[canvas.create_text(x, -MATRIX_STEP, text="", font=("Consolas", 8),
+                                           tags=("matrix", f"slot{s}"))
+                        for s in range(MATRIX_TRAIL)] for x in xs]
+        self.frame  = 0
+
+    def _paused(self) -> bool:
+        try: return root.state() == "iconic" or root.focus_displayof() is None
+        except (KeyError, tk.TclError): return False
+
+    def step(self) -> None:
+        slot = self.frame % MATRIX_TRAIL
+        for s in range(MATRIX_TRAIL):
+            self.canvas.itemconfig(f"slot{s}", fill=self.colors[(slot - s) % MATRIX_TRAIL])
+        for col, x in enumerate(self.xs):
+            y, item = self.heads[col], self.items[col][slot]
+            self.canvas.coords(item, x, y)
+            self.canvas.itemconfig(item, text=random.choice(MATRIX_CHARS))
+            y += MATRIX_STEP
+            self.heads[col] = y if y <= self.height + 50 else random.randint(-200, 0)
+        self.frame += 1
+
+    def tick(self) -> None:
+        if not self.canvas.winfo_exists(): return         # connect screen is gone
+        if self._paused():
+            self.canvas.after(MATRIX_IDLE_MS, self.tick); return
+        t = time.perf_counter()
+        self.step()
+        spent = time.perf_counter() - t
+        self.canvas.after(max(MATRIX_FRAME_MS, int(spent * 1000 / MATRIX_BUDGET)), self.tick)
+
+
+# ───────────────────────── join form ────────────────────────────────────
+def join_form(parent: tk.Widget, name: str = "") -> tk.Button:
+    """Name / session / password rows and a Connect button that opens the
+    session in a new tab; returns the button so the caller can gate it."""
+    name_v, room_v, pwd_v = tk.StringVar(value=name), tk.StringVar(), tk.StringVar()
 
-        # upload to imgbb
-        resp = requests.post("https://api.imgbb.com/1/upload", data={
-            "key": IMGBB_API_KEY,
-            "image": b64,
-            "expiration": 600  # delete after 10 minutes
-        })
+    def add_row(label, var, hide=False):
+        tk.Label(parent, text=label, fg=TX_FG, bg=TX_BG, font=FONT).pack(pady=5)
+        tk.Entry(parent, textvariable=var, show="*" if hide else "",
+                 font=FONT, bg="#111", fg=TX_FG, insertbackground=TX_FG).pack(pady=5)
 
-        if resp.status_code == 200:
-            return resp.json()["data"]["url"]
-        return None
+    add_row("Display name:", name_v)
+    add_row("Session ID (blank = new):", room_v)
+    add_row("Password:", pwd_v, hide=True)
 
-    except Exception as e:
-        print(f"[ERROR] upload_clipboard_image(): {e}")
-        return None
+    err_lbl = tk.Label(parent, text="", fg="#f00", bg=TX_BG, font=FONT); err_lbl.pack(pady=(0,10))
+
+    def connect():
+        name, sid, pwd = name_v.get().strip(), room_v.get().strip(), pwd_v.get().strip()
+        if not name: err_lbl.config(text="Enter display name"); return
+        if not pwd:  err_lbl.config(text="Enter password");     return
+        if sid in tabs:
+            if notebook is not None: notebook.select(tabs[sid].page)
+            return
+        err_lbl.config(text="Connecting…", fg=TX_FG)
+        connect_btn.config(state="disabled")
+
+        def joined(new_sid: str, replay: bool = False):
+            crypter.init_session(new_sid, pwd)
+            history_from = chat.history_cursor() if replay else None   # before our own join line
+            sent = chat.send_encrypted_from_thread(new_sid, f"System:{name} has joined the session")
+            tab  = open_session_tab(new_sid, name, history_from)
+            on_future_done(sent, lambda _: None,
+                           lambda e: tab.notice(f"[Join notice not delivered: {e}]"))
+            if err_lbl.winfo_exists():                  # the "+" tab keeps its form
+                err_lbl.config(text=""); connect_btn.config(state="normal")
+                room_v.set(""); pwd_v.set("")
+
+        def failed(msg: str):
+            if not err_lbl.winfo_exists(): return
+            err_lbl.config(text=msg, fg="#f00")
+            connect_btn.config(state="normal")
 
+        if sid:
+            on_future_done(chat.join_existing_session_async(sid),
+                        lambda ok: joined(sid, True) if ok else failed("Session ID not found"),
+                        lambda e: failed(f"Join failed: {e}"))
+        else:
+            on_future_done(chat.start_auto_session_async(), joined,
+                        lambda e: failed(f"Could not start session: {e}"))
+
+    connect_btn = tk.Button(parent, text="Connect", command=connect,
+                            font=("Consolas", 14, "bold"),
+                            fg=TX_FG, bg="#222", bd=0, activebackground="#333")
+    connect_btn.pack(pady=(20, 5))
+    return connect_btn
 
 # ───────────────────────── connect UI ───────────────────────────────────
 def show_connect_ui():
@@ -176,52 +394,8 @@ def show_connect_ui():
     canvas.place(relx=0, rely=0, relwidth=1, relheight=1)
     canvas.lower("all")  # ensure all widgets appear above
 
-    # 2. Setup drops in left/right thirds
-    char_w = 10
-    canvas_w, canvas_h = 600, 500
-    num_cols = canvas_w // char_w
-
-    drops = []
-    for i in range(num_cols):
-        x = i * char_w
-        if x < 180 or x > 420:
-            drops.append({"x": x, "y": random.randint(-500, 0), "trail": []})
-
-    matrix_chars = "01ABCDEFGHIJKLMNOPQRSTUVWXYZ"
-
-    # 3. Enhanced movie-style effect
-    def matrix_effect():
-        if not canvas.winfo_exists():
-            return
-
-        canvas.delete("matrix")
-        for drop in drops:
-            x, y = drop["x"], drop["y"]
-            char = random.choice(matrix_chars)
-            drop["trail"].insert(0, (x, y, char))
-            drop["trail"] = drop["trail"][:12]
-
-            for i, (tx, ty, tch) in enumerate(drop["trail"]):
-                if ty > canvas_h or ty < 0:
-                    continue
-                if i == 0:
-                    color = "#0f0"  # bright neon green head
-                else:
-                    fade = hex(max(0, 15 - i * 2))[2:].zfill(2)
-                    color = f"#00{fade}00"  # fading tail
-                canvas.create_text(tx, ty, text=tch, fill=color, font=("Consolas", 8), tags="matrix")
-
-            drop["y"] += 15
-            if drop["y"] > canvas_h + 50:
-                drop["y"] = random.randint(-200, 0)
-                drop["trail"].clear()
-
-        frame.after(75, matrix_effect)
-
-    matrix_effect()
-
-
-
+    # 2. Drops in the left/right thirds, drawn by a retained-mode renderer
+    MatrixRain(canvas, [x for x in range(0, 600, 10) if x < 180 or x > 420], 500).tick()
 
     # ASCII logo appears ON TOP of matrix
     ascii_label = tk.Label(frame, fg=TX_FG, bg=TX_BG, font=("Consolas", 9), justify="left")
@@ -250,133 +424,196 @@ def show_connect_ui():
     root.bind("<Escape>", lambda _: on_close())
 
 
-    name_v, room_v, pwd_v = tk.StringVar(), tk.StringVar(), tk.StringVar()
-
-    def add_row(label, var, hide=False):
-        tk.Label(frame, text=label, fg=TX_FG, bg=TX_BG, font=FONT).pack(pady=5)
-        tk.Entry(frame, textvariable=var, show="*" if hide else "",
-                 font=FONT, bg="#111", fg=TX_FG, insertbackground=TX_FG).pack(pady=5)
-
-    add_row("Display name:", name_v)
-    add_row("Session ID (blank = new):", room_v)
-    add_row("Password:", pwd_v, hide=True)
-
-    err_lbl = tk.Label(frame, text="", fg="#f00", bg=TX_BG, font=FONT); err_lbl.pack(pady=(0,10))
+    connect_btn = join_form(frame)
+    status_lbl = tk.Label(frame, text="", fg="#555", bg=TX_BG, font=("Consolas", 9))
+    status_lbl.pack()
 
-    def connect():
-        global current_session, user_name, _my_receive_cb
-        name, sid, pwd = name_v.get().strip(), room_v.get().strip(), pwd_v.get().strip()
-        if not name: err_lbl.config(text="Enter display name"); return
-        if not pwd:  err_lbl.config(text="Enter password");     return
-        try: asyncio.run_coroutine_threadsafe(sync_active_sessions(), bot.loop).result(5)
-        except Exception: pass
-        if sid and sid not in session_counts:
-            err_lbl.config(text="Session ID not found"); return
-        err_lbl.config(text="")
-
-        if sid:
-            join_session_from_thread(sid)
-            crypter.init_session(sid, pwd)
+    def backend_status():
+        global _backend_listener
+        if not status_lbl.winfo_exists(): _backend_listener = None; return
+        if backend_ready.is_set():
+            status_lbl.config(text="● online", fg=TX_FG)
+            connect_btn.config(state="normal")
+        elif backend_error:
+            status_lbl.config(text=backend_error, fg="#f00")
         else:
-            sid = start_auto_session_from_thread(GUILD_ID)
-            crypter.init_session(sid, pwd)
-
-        current_session = sid; user_name = name
+            status_lbl.config(text="○ connecting to Discord…")
+            connect_btn.config(state="disabled")   # until the bot has synced sessions
 
-        payload = f"System:{name} has joined the session"
-        enc = crypter.encrypt_message(payload, pwd)
-        send_session_message_from_thread(sid, base64.urlsafe_b64encode(enc).decode())
-        show_chat_ui()
-
-    tk.Button(frame, text="Connect", command=connect,
-              font=("Consolas", 14, "bold"),
-              fg=TX_FG, bg="#222", bd=0, activebackground="#333").pack(pady=20)
+    global _backend_listener
+    _backend_listener = backend_status
+    backend_status()
 
 # ───────────────────────── chat UI ───────────────────────────────────────
-def show_chat_ui():
+class SessionTab:
+    """One joined session: its notebook page and what leaving has to undo."""
+
+    def __init__(self, sid: str, name: str, page: tk.Frame):
+        self.sid, self.name, self.page = sid, name, page
+        self.receive_cb = inbox_callback(sid)
+        self.entry: Optional[tk.Entry] = None
+        self.paste: Callable[[], None] = lambda: None
+        self.notice: Callable[[str], None] = lambda line: None   # a line in the tab, if still open
+
+    def leave(self) -> Future:
+        """Stop receiving and say goodbye; once that's out, drop the key and
+        give up our seat. The returned future resolves when the seat is gone."""
+        tabs.pop(self.sid, None); _inbox_handlers.pop(self.sid, None)
+        chat.unregister_receive_callback(self.sid, self.receive_cb)
+        left: Future = Future()
+        def give_up(_):
+            chat.forget_session_key(self.sid)
+            chat.leave_session_async(self.sid).add_done_callback(lambda _: left.set_result(None))
+        chat.send_encrypted_from_thread(
+            self.sid, f"System:{self.name} has left the session").add_done_callback(give_up)
+        return left
+
+def _selected_tab() -> Optional[SessionTab]:
+    if notebook is None or not notebook.winfo_exists(): return None
+    page = notebook.select()
+    return next((t for t in tabs.values() if str(t.page) == page), None)
+
+def _tab_changed(_evt=None):
+    tab = _selected_tab()
+    if tab is None: return
+    notebook.tab(tab.page, text=tab.sid)        # clear the unread marker
+    if tab.entry is not None: tab.entry.focus_set()
+
+def _paste(_evt=None):
+    tab = _selected_tab()
+    if tab is not None: tab.paste()
+
+def _chat_view(name: str) -> ttk.Notebook:
+    """The tabbed chat view (replacing the connect screen), built on first use;
+    its last tab is a join form, prefilled with <name>, for more sessions."""
+    global notebook
+    if notebook is not None and notebook.winfo_exists(): return notebook
     clear_frame()
-    assert current_session
-    sid = current_session
-
-    chat_box = tk.Text(frame, bg=TX_BG, fg=TX_FG, font=FONT, state="disabled")
+    style = ttk.Style(); style.theme_use("default")
+    style.configure("TNotebook", background=TX_BG, borderwidth=0)
+    style.configure("TNotebook.Tab", background="#111", foreground=TX_FG, font=FONT, padding=(8, 2))
+    style.map("TNotebook.Tab", background=[("selected", "#222")])
+    notebook = ttk.Notebook(frame); notebook.pack(fill="both", expand=True)
+    more = tk.Frame(notebook, bg=TX_BG)
+    join_form(more, name)
+    notebook.add(more, text=" + ")
+    notebook.bind("<<NotebookTabChanged>>", _tab_changed)
+    root.bind("<Control-v>", _paste)
+    return notebook
+
+def open_session_tab(sid: str, name: str, history_from: Optional[int] = None) -> SessionTab:
+    """Chat tab for a joined session; with <history_from> (a chat.history_cursor())
+    the backlog sent before it is paged in above as the user scrolls up."""
+    book = _chat_view(name)
+    page = tk.Frame(book, bg=TX_BG)
+    tab  = tabs[sid] = SessionTab(sid, name, page)
+    book.insert(book.index("end") - 1, page, text=sid)
+
+    chat_box = tk.Text(page, bg=TX_BG, fg=TX_FG, font=FONT, state="disabled")
     chat_box.pack(fill="both", expand=True, padx=5, pady=5)
 
-    def put(line: str, expire_after: int = 600):
-        chat_box.config(state="normal")
-        tag = f"msg_{time.time()}"  # unique tag per line
-        chat_box.insert("end", line + "\n", tag)
-        chat_box.config(state="disabled")
-        chat_box.see("end")
-
-        def clear():
-            chat_box.config(state="normal")
-            chat_box.delete(f"{tag}.first", f"{tag}.last +1l")
-            chat_box.config(state="disabled")
-
-        chat_box.after(expire_after * 1000, clear)
+    scrollback = Scrollback(chat_box)
 
+    def put(line: str, expire_after: float = LINE_TTL, old: bool = False):
+        scrollback.add(line, expire_after, old)
 
     put(f"--- Session {sid} ---")
 
-    def _recv(msg: str):
+    def notice(line: str):
+        if chat_box.winfo_exists(): put(line)
+
+    def put_image(caption: str, expire_after: float = LINE_TTL,
+                  old: bool = False) -> Tuple[Callable, Callable]:
+        """Insert <caption> over a placeholder; returns (show(img), broken(exc)) to resolve it."""
+        # history entries each go in at the top, so there the image goes first;
+        # a pair that doesn't fit the scrollback is skipped whole
+        img_label = None
+        if not old: put(caption, expire_after)
+        if not old or len(scrollback.entries) + 2 <= SCROLLBACK_LINES:
+            img_label = scrollback.add_image(expire_after, old)
+            if old: put(caption, expire_after, old)
+
+        def show(img):
+            if img_label is None or not img_label.winfo_exists(): return
+            from PIL import ImageTk
+            photo = ImageTk.PhotoImage(img)
+            img_label.config(image=photo, text="")
+            setattr(img_label, "image", photo)                # keep ref
+
+        def broken(e: Exception):
+            if img_label is not None and img_label.winfo_exists():
+                img_label.config(text=f"[Error displaying image: {e}]")
+
+        return show, broken
+
+    def _recv_batch(msgs: List[str]):
+        for msg in msgs: _recv(msg)
+        if book.select() != str(page): book.tab(page, text=f"{sid} •")
+
+    def _recv(msg: str, sent: Optional[float] = None):
+        # <sent> marks a history line: it goes above the rest and keeps its age
+        old = sent is not None
+        ttl = LINE_TTL - (time.time() - sent) if sent is not None else LINE_TTL
+        if ttl <= 0: return
+
         if msg.startswith("System:"):
-            put(f"*** {msg.split(':', 1)[1]} ***")
+            put(f"*** {msg.split(':', 1)[1]} ***", ttl, old)
 
         elif msg.startswith("Client disconnected"):
-            put(f"*** {msg} ***")
-            entry.config(state="disabled")
-            send_btn.config(state="disabled")
+            put(f"*** {msg} ***", ttl, old)
+            if not old:
+                entry.config(state="disabled")
+                send_btn.config(state="disabled")
+
+        # IMAGE branches: encrypted attachment, or a link from an older client
+        elif (digest := chat.image_ref(msg)):
+            show, broken = put_image(f"< [Image] {msg.split(':', 1)[0]}", ttl, old)
+            on_future_done(chat.image_blob_async(digest),
+                           lambda data: on_future_done(
+                               _images().thumbnail_from_bytes(f"blob:{digest}", data), show, broken),
+                           broken)
 
-        # IMAGE branch
         elif "http" in msg and (msg.endswith(".png") or msg.endswith(".jpg") or ".ibb.co" in msg):
-            sender, body = msg.split(":", 1)
-            put(f"< [Image] {sender}: {body.strip()}")
-
-            try:
-                from PIL import Image, ImageTk
-                import urllib.request
-
-                # download
-                resp = urllib.request.urlopen(body.strip())
-                img_data = resp.read()
-                img = Image.open(io.BytesIO(img_data))
-
-                # cap size, preserve aspect ratio
-                max_w = 300
-                max_h = 300
-                img.thumbnail((max_w, max_h))
-
-                photo = ImageTk.PhotoImage(img)
-
-                # inject blank line + image + blank line
-                chat_box.config(state="normal")
-                chat_box.insert("end", "\n")                      # ensure on new line
-                img_label = tk.Label(chat_box, image=photo, bg=TX_BG)
-                setattr(img_label, "image", photo)                # keep ref
-                chat_box.window_create("end", window=img_label)
-                chat_box.insert("end", "\n\n")                    # pad after
-                chat_box.config(state="disabled")
-                chat_box.see("end")
-
-            except Exception as e:
-                put(f"[Error displaying image: {e}]")
-
+            sender, _, body = msg.partition(":")
+            show, broken = put_image(f"< [Image] {sender}: {body.strip()}", ttl, old)
+            on_future_done(_images().fetch_thumbnail(body.strip()), show, broken)
 
         else:
-            sender, body = msg.split(":", 1)
-            if sender != user_name:
-                put(f"< [{sender}] {body}")
-
-    register_receive_callback(sid, _recv)
-    global _my_receive_cb
-    _my_receive_cb = _recv
-
-    bottom = tk.Frame(frame, bg=TX_BG)
+            sender, _, body = msg.partition(":")
+            if old or sender != name:          # own live lines are echoed on send
+                put(f"< [{sender}] {body}", ttl, old)
+
+    # history: one decrypted page at a time, fetched while the top is in view
+    history: Dict[str, Any] = {"cursor": history_from, "busy": False}
+
+    def load_history():
+        if history["busy"] or history["cursor"] is None: return
+        history["busy"] = True
+        on_future_done(chat.history_page_async(sid, history["cursor"]), got_history,
+                       lambda e: put(f"[History unavailable: {e}]"))
+
+    def got_history(page: Tuple[List[Tuple[str, float]], Optional[int]]):
+        lines, history["cursor"] = page
+        history["busy"] = False
+        if not chat_box.winfo_exists(): return
+        for plain, sent in lines: _recv(plain, sent)
+        if len(scrollback.entries) >= SCROLLBACK_LINES: history["cursor"] = None
+        if chat_box.yview()[0] <= 0.0: load_history()  # page didn't fill the view
+
+    chat_box.config(yscrollcommand=lambda first, _last: float(first) <= 0.0 and load_history())
+
+    _inbox_handlers[sid] = _recv_batch
+    chat.register_receive_callback(sid, tab.receive_cb)
+    load_history()
+
+    bottom = tk.Frame(page, bg=TX_BG)
     bottom.pack(fill="x", side="bottom", padx=5, pady=5)
 
     entry = tk.Entry(bottom, bg="#111", fg=TX_FG, font=FONT, insertbackground=TX_FG)
     entry.pack(side="left", fill="x", expand=True)
 
+    leave_btn = tk.Button(bottom, text="Leave", fg=TX_FG, bg="#111", font=FONT)
+    leave_btn.pack(side="right", padx=(5, 0))
     send_btn = tk.Button(bottom, text="Send", fg=TX_FG, bg="#111", font=FONT)
     send_btn.pack(side="right", padx=(5, 0))
 
@@ -386,30 +623,71 @@ def show_chat_ui():
             return
         entry.delete(0, "end")
         put(f"> {txt}")
-        payload = f"{user_name}:{txt}"
-        pwd = crypter.session_passwords[sid]
-        enc = crypter.encrypt_message(payload, pwd)
-        send_session_message_from_thread(
-            sid, base64.urlsafe_b64encode(enc).decode()
-        )
+        on_future_done(chat.send_encrypted_from_thread(sid, f"{name}:{txt}"), lambda _: None,
+                       lambda e: notice(f"[Not delivered: {txt} ({e})]"))
+
+    upload_lbl = tk.Label(bottom, text="", fg=TX_FG, bg=TX_BG, font=FONT)
+    cancel_btn = tk.Button(bottom, text="✕", fg=TX_FG, bg="#111", font=FONT, bd=0)
+    upload_cancel: List[threading.Event] = []
+
+    def _upload_status(text: str):
+        if not upload_lbl.winfo_exists(): return
+        if text:
+            upload_lbl.config(text=text)
+            upload_lbl.pack(side="left", padx=(5, 0)); cancel_btn.pack(side="left")
+        else:
+            upload_lbl.pack_forget(); cancel_btn.pack_forget()
+
+    def _cancel_upload():
+        for ev in upload_cancel: ev.set()
 
     def on_paste(_evt=None):
-        url = upload_clipboard_image()
-        if url:
+        if upload_cancel: return                    # one upload at a time
+        img = grab_clipboard_image()
+        if img is None: return
+        cancel = threading.Event(); upload_cancel.append(cancel)
+        shown = [-1]
+
+        def progress(frac: float):                  # encryption worker thread
+            pct = int(frac * 100)
+            if pct != shown[0]:
+                shown[0] = pct
+                _ui_calls.put(lambda: _upload_status(f"[encrypting {pct}%]"))
+
+        def encoded(data: bytes):
+            if cancel.is_set(): failed(chat.TransferCancelled()); return
+            _upload_status("[encrypting]")
+            on_future_done(chat.send_image_from_thread(sid, data, name, progress, cancel),
+                           sent, failed)
+
+        def sent(_latency: float):
+            upload_cancel.clear(); _upload_status("")
             put("> [Image pasted]")
-            payload = f"{user_name}:{url}"
-            pwd     = crypter.session_passwords[sid]
-            enc     = crypter.encrypt_message(payload, pwd)
-            send_session_message_from_thread(
-                sid, base64.urlsafe_b64encode(enc).decode()
-            )
 
+        def failed(e: Exception):
+            upload_cancel.clear(); _upload_status("")
+            if not isinstance(e, chat.TransferCancelled):
+                put(f"[Image upload failed: {e}]")
+
+        _upload_status("[encoding image]")
+        on_future_done(_images().encode_async(img), encoded, failed)
+
+    def _leave():
+        _cancel_upload()
+        tab.leave()
+        book.forget(page); page.destroy()
+        if not tabs: show_connect_ui()              # last one gone: back to the start
 
+    cancel_btn.config(command=_cancel_upload)
     send_btn.config(command=_send)
+    leave_btn.config(command=_leave)
     entry.bind("<Return>", _send)
-    root.bind("<Control-v>", on_paste)
-    entry.focus_set()
+    tab.entry, tab.paste, tab.notice = entry, on_paste, notice
+    book.select(page)
+    return tab
 
 
 # ───────────────────────── start app ────────────────────────────────────
-show_connect_ui(); root.mainloop()
+show_connect_ui(); root.update(); _mark("window")
+threading.Thread(target=_load_backend, daemon=True).start()
+_pump(); root.mainloop()
@@ -0,0 +1,150 @@
+# images.py — inline image decode/thumbnail and paste encoding, all off the Tk thread
+
+import io, threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from PIL import Image, features
+
+MAX_DOWNLOAD = 8 * 1024 * 1024          # refuse bodies larger than this
+THUMB_SIZE   = (300, 300)
+CACHE_BYTES  = 32 * 1024 * 1024         # decoded thumbnail budget
+CHUNK        = 64 * 1024
+
+
+class ThumbnailCache:
+    """Byte-bounded LRU of URL → decoded thumbnail (thread-safe)."""
+
+    def __init__(self, max_bytes: int = CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items: "OrderedDict[str, Tuple[Image.Image, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _cost(img: Image.Image) -> int:
+        return img.width * img.height * len(img.getbands())
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is None: return None
+            self._items.move_to_end(key)
+            return hit[0]
+
+    def put(self, key: str, img: Image.Image) -> None:
+        cost = self._cost(img)
+        if cost > self.max_bytes: return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old: self.size -= old[1]
+            self._items[key] = (img, cost); self.size += cost
+            while self.size > self.max_bytes:
+                _, (_, c) = self._items.popitem(last=False)
+                self.size -= c
+
+
+thumbnails = ThumbnailCache()
+
+_http = requests.Session()              # keep-alive connections across images
+_http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+_http.mount("http://",  HTTPAdapter(pool_connections=4, pool_maxsize=4))
+_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="images")
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def _download(url: str) -> bytes:
+    with _http.get(url, stream=True, timeout=10) as resp:
+        resp.raise_for_status()
+        if int(resp.headers.get("Content-Length") or 0) > MAX_DOWNLOAD:
+            raise ValueError("image too large")
+        buf = io.BytesIO()
+        for chunk in resp.iter_content(CHUNK):
+            buf.write(chunk)
+            if buf.tell() > MAX_DOWNLOAD:
+                raise ValueError("image too large")
+        return buf.getvalue()
+
+
+def _thumbnail(data: bytes) -> Image.Image:
+    img = Image.open(io.BytesIO(data))
+    img.draft("RGB", THUMB_SIZE)            # cheap JPEG downscale while decoding
+    img.thumbnail(THUMB_SIZE)
+    img.load()
+    return img
+
+
+def _load(key: str, fetch: Callable[[], bytes]) -> Image.Image:
+    try:
+        img = _thumbnail(fetch())
+        thumbnails.put(key, img)
+        return img
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def _cached_or_submit(key: str, fetch: Callable[[], bytes]) -> Future:
+    img = thumbnails.get(key)
+    if img is not None:
+        done: Future = Future(); done.set_result(img)
+        return done
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        if fut is None:
+            fut = _inflight[key] = _pool.submit(_load, key, fetch)
+        return fut
+
+
+def fetch_thumbnail(url: str) -> Future:
+    """Future[PIL.Image]: cached, or downloaded and thumbnailed off-thread.
+
+    Concurrent requests for the same URL share one download.
+    """
+    return _cached_or_submit(url, lambda: _download(url))
+
+
+def thumbnail_from_bytes(key: str, data: bytes) -> Future:
+    """Future[PIL.Image]: thumbnail already-fetched image bytes off-thread."""
+    return _cached_or_submit(key, lambda: data)
+
+
+# ───────────────────────── paste encoding ───────────────────────────────
+MAX_UPLOAD_DIM  = 1920                  # longest side after downscaling
+UPLOAD_TARGET   = 1024 * 1024           # aim for encoded images under this many bytes
+
+_encode_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="encode")
+
+
+def _is_flat(img: Image.Image) -> bool:
+    # screenshots, diagrams and text: few distinct colours, PNG wins
+    return img.convert("RGB").getcolors(maxcolors=4096) is not None
+
+
+def encode_for_upload(img: Image.Image, target: int = UPLOAD_TARGET) -> Tuple[bytes, str, str]:
+    """Downscale and pick PNG / WebP / JPEG for <img>; returns (data, mime, ext)."""
+    if max(img.size) > MAX_UPLOAD_DIM:
+        img = img.copy(); img.thumbnail((MAX_UPLOAD_DIM, MAX_UPLOAD_DIM))
+    has_alpha = img.mode in ("RGBA", "LA") or "transparency" in img.info
+    if _is_flat(img):
+        buf = io.BytesIO(); img.save(buf, format="PNG", optimize=True)
+        if buf.tell() <= target or has_alpha:
+            return buf.getvalue(), "image/png", "png"
+    webp = features.check("webp")
+    fmt, mime, ext = ("WEBP", "image/webp", "webp") if webp else ("JPEG", "image/jpeg", "jpg")
+    img = img.convert("RGBA" if webp and has_alpha else "RGB")
+    data = b""
+    for quality in (85, 75, 60, 45):
+        buf = io.BytesIO(); img.save(buf, format=fmt, quality=quality)
+        data = buf.getvalue()
+        if len(data) <= target: break
+    return data, mime, ext
+
+
+def encode_async(img: Image.Image) -> Future:
+    """Future[bytes]: encode_for_upload(<img>) on the encode worker."""
+    return _encode_pool.submit(lambda: encode_for_upload(img)[0])
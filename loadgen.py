@@ -0,0 +1,139 @@
+# loadgen.py — drive N sessions × M headless users and report latency/throughput
+#
+#   python loadgen.py --sessions 20 --users 4 --rate 0.5 --duration 30
+#   python loadgen.py --latency 0.08 --json      # model ~80 ms per Discord API call
+#   python loadgen.py --live ...                 # against the Discord server in .env
+
+import argparse, heapq, json, random, sys, threading, time
+from typing import Dict, List
+
+import fakediscord
+
+
+def percentile(values: List[float], p: float) -> float:
+    if not values: return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def _summary(values: List[float]) -> Dict[str, float]:
+    return {"p50": percentile(values, 50), "p90": percentile(values, 90),
+            "p99": percentile(values, 99), "max": max(values, default=0.0)}
+
+
+def run(args: argparse.Namespace) -> Dict:
+    world = None if args.live else fakediscord.install(
+        guilds=args.guilds, latency=args.latency,
+        rate_limit=None if args.no_rate_limit else (5, 5.0),
+        hook_rate_limit=None if args.no_rate_limit else (30, 60.0))
+    import chat, client                         # after install(): chat must see the fake
+    from dotenv import load_dotenv; load_dotenv()
+    client.start_bot()
+
+    e2e: List[float] = []                       # send → decrypted at another user
+    acks: List[float] = []                      # send → Discord accepted the message
+    errors = {"join": 0, "send": 0}
+    lock = threading.Lock()
+
+    def on_message(sender: str, body: str) -> None:
+        if not body.startswith("lg "): return
+        sent_at = float(body.split(" ", 2)[1])
+        with lock: e2e.append(time.perf_counter() - sent_at)
+
+    rooms: List[List["client.Client"]] = []
+    setup = time.perf_counter()
+    for s in range(args.sessions):
+        users = [client.Client(f"s{s}u{u}", on_message) for u in range(args.users)]
+        sid = users[0].start(args.password)
+        for u in users[1:]:
+            if not u.join(sid, args.password): errors["join"] += 1
+        rooms.append([u for u in users if u.sid])
+    setup = time.perf_counter() - setup
+
+    def acked(fut) -> None:
+        with lock:
+            if fut.exception() is None: acks.append(fut.result())
+            else:                       errors["send"] += 1
+
+    pad = "x" * max(0, args.size)
+    users = [u for room in rooms for u in room]
+    heap = [(random.uniform(0, 1 / args.rate), i) for i in range(len(users))]
+    heapq.heapify(heap)
+    sent, expected, futures = 0, 0, []
+    start = time.perf_counter()
+    while True:
+        due, i = heapq.heappop(heap)
+        if due > args.duration: break
+        time.sleep(max(0.0, start + due - time.perf_counter()))
+        u = users[i]
+        fut = u.send(f"lg {time.perf_counter()!r} {pad}")
+        fut.add_done_callback(acked); futures.append(fut)
+        sent += 1; expected += len(rooms[int(u.name[1:].split("u")[0])]) - 1
+        heapq.heappush(heap, (due + 1 / args.rate, i))
+    send_window = time.perf_counter() - start
+
+    deadline = time.perf_counter() + args.drain
+    while time.perf_counter() < deadline:
+        with lock:
+            if len(e2e) >= expected and all(f.done() for f in futures): break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - start
+    for u in users:
+        try: u.leave()
+        except Exception: errors["send"] += 1
+
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k != "password"},
+        "setup_s": setup, "elapsed_s": elapsed,
+        "sent": sent, "expected_deliveries": expected, "delivered": len(e2e),
+        "lost": max(0, expected - len(e2e)), "errors": errors,
+        "throughput": {"sent_per_s": sent / send_window if send_window else 0.0,
+                       "delivered_per_s": len(e2e) / elapsed if elapsed else 0.0},
+        "e2e_latency_s": _summary(e2e), "ack_latency_s": _summary(acks),
+        "send_stats": dict(chat.send_stats), "counter_stats": dict(chat.counter_stats),
+    }
+    if world is not None:
+        report["discord"] = {"api_calls": world.api_calls(), "rate_limited": world.calls["429"],
+                             "calls": dict(world.calls)}
+        world.bot.close()
+    return report
+
+
+def _print(report: Dict) -> None:
+    ms = lambda d: "  ".join(f"{k}={v * 1000:.1f}ms" for k, v in d.items())
+    print(f"setup {report['setup_s']:.2f}s, run {report['elapsed_s']:.2f}s")
+    print(f"sent {report['sent']}  delivered {report['delivered']}/{report['expected_deliveries']}"
+          f"  lost {report['lost']}  errors {report['errors']}")
+    print(f"throughput  {report['throughput']['sent_per_s']:.1f} sent/s  "
+          f"{report['throughput']['delivered_per_s']:.1f} delivered/s")
+    print(f"end-to-end  {ms(report['e2e_latency_s'])}")
+    print(f"send ack    {ms(report['ack_latency_s'])}")
+    print(f"packing     {report['send_stats']}")
+    if "discord" in report:
+        print(f"discord     {report['discord']['api_calls']} API calls, "
+              f"{report['discord']['rate_limited']} rate-limited")
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="StealthChat load generator")
+    p.add_argument("--sessions", type=int, default=10, help="concurrent sessions")
+    p.add_argument("--users", type=int, default=3, help="users per session")
+    p.add_argument("--rate", type=float, default=0.5, help="messages per second per user")
+    p.add_argument("--duration", type=float, default=20, help="seconds of sending")
+    p.add_argument("--size", type=int, default=32, help="padding characters per message")
+    p.add_argument("--drain", type=float, default=30, help="max seconds to wait for deliveries")
+    p.add_argument("--guilds", type=int, default=1, help="fake guilds (shards)")
+    p.add_argument("--latency", type=float, default=0.0, help="fake seconds per API call")
+    p.add_argument("--no-rate-limit", action="store_true", help="fake Discord never returns 429")
+    p.add_argument("--password", default="loadgen")
+    p.add_argument("--live", action="store_true", help="use the real Discord config in .env")
+    p.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = p.parse_args(argv)
+    report = run(args)
+    if args.json: json.dump(report, sys.stdout, indent=2); print()
+    else:         _print(report)
+    return 1 if report["lost"] or any(report["errors"].values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
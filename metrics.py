@@ -0,0 +1,202 @@
+# metrics.py — counters, latency histograms and gauges, exported as
+# Prometheus text or JSON, plus an opt-in cProfile toggle for the bot loop
+
+import bisect, cProfile, io, json, os, pstats, threading, time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional, Tuple, Union
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+GaugeFn = Callable[[], Union[float, Dict[str, float]]]
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "max")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)      # last slot is +Inf
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        if value > self.max: self.max = value
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket holding the q-th observation
+        total, seen = sum(self.counts), 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if total and seen >= q * total:
+                return BUCKETS[i] if i < len(BUCKETS) else self.max
+        return 0.0
+
+
+class Registry:
+    """Thread-safe metric store: crypto workers and the bot loop both record."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters:   Dict[str, Dict[Labels, float]] = {}
+        self.histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self.gauges:     Dict[str, Tuple[GaugeFn, str]] = {}
+        self.help:       Dict[str, str] = {}
+
+    @staticmethod
+    def _labels(labels: Dict[str, object]) -> Labels:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, n: float = 1, **labels) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + n
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = self._labels(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None: hist = series[key] = _Histogram()
+            hist.observe(value)
+
+    def gauge(self, name: str, fn: GaugeFn, label: str = "", doc: str = "") -> None:
+        """Sample <fn> at export time; a dict result becomes one series per <label> value."""
+        self.gauges[name] = (fn, label)
+        if doc: self.help[name] = doc
+
+    def drop(self, **labels) -> None:
+        """Forget every counter and histogram series carrying all of <labels>."""
+        want = set(self._labels(labels))
+        with self._lock:
+            for table in (self.counters, self.histograms):
+                for series in table.values():
+                    for key in [k for k in series if want <= set(k)]: del series[key]
+
+    def describe(self, name: str, doc: str) -> None:
+        self.help[name] = doc
+
+    def _gauge_series(self) -> Dict[str, Dict[Labels, float]]:
+        out = {}
+        for name, (fn, label) in list(self.gauges.items()):
+            try: value = fn()
+            except Exception: continue
+            if isinstance(value, dict):
+                out[name] = {((label, str(k)),): float(v) for k, v in value.items()}
+            else:
+                out[name] = {(): float(value)}
+        return out
+
+    def prometheus(self) -> str:
+        def fmt(labels: Labels, extra: str = "") -> str:
+            parts = [f'{k}="{v}"' for k, v in labels] + ([extra] if extra else [])
+            return "{" + ",".join(parts) + "}" if parts else ""
+        lines = []
+        def header(name: str, kind: str) -> None:
+            if name in self.help: lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+        with self._lock:
+            counters   = {n: dict(s) for n, s in self.counters.items()}
+            histograms = {n: {k: (list(h.counts), h.sum) for k, h in s.items()}
+                          for n, s in self.histograms.items()}
+        for name, series in sorted(counters.items()):
+            header(name, "counter")
+            lines += [f"{name}{fmt(k)} {v:g}" for k, v in sorted(series.items())]
+        for name, series in sorted(self._gauge_series().items()):
+            header(name, "gauge")
+            lines += [f"{name}{fmt(k)} {v:g}" for k, v in sorted(series.items())]
+        for name, series in sorted(histograms.items()):
+            header(name, "histogram")
+            for k, (counts, total) in sorted(series.items()):
+                running = 0
+                for bound, n in zip(BUCKETS + (float("inf"),), counts):
+                    running += n
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                    lines.append(f"{name}_bucket{fmt(k, le)} {running}")
+                lines.append(f"{name}_sum{fmt(k)} {total:g}")
+                lines.append(f"{name}_count{fmt(k)} {running}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict:
+        def key(labels: Labels) -> str:
+            return ",".join(f"{k}={v}" for k, v in labels) or "_"
+        with self._lock:
+            counters = {n: {key(k): v for k, v in s.items()} for n, s in self.counters.items()}
+            histograms = {n: {key(k): {"count": sum(h.counts), "sum": h.sum,
+                                       "mean": h.sum / max(1, sum(h.counts)),
+                                       "p50": h.quantile(0.5), "p99": h.quantile(0.99),
+                                       "max": h.max}
+                              for k, h in s.items()} for n, s in self.histograms.items()}
+        gauges = {n: {key(k): v for k, v in s.items()} for n, s in self._gauge_series().items()}
+        return {"time": time.time(), "counters": counters, "gauges": gauges,
+                "histograms": histograms}
+
+
+registry = Registry()
+inc, observe, gauge, describe, drop = (registry.inc, registry.observe, registry.gauge,
+                                       registry.describe, registry.drop)
+
+
+@contextmanager
+def timer(name: str, **labels) -> Iterator[None]:
+    """Record the block's wall time (works around awaits too)."""
+    t = time.perf_counter()
+    try: yield
+    finally: registry.observe(name, time.perf_counter() - t, **labels)
+
+
+def dump_json(path: str) -> None:
+    with open(path + ".tmp", "w") as f: json.dump(registry.snapshot(), f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+# ───────────────────────── profiler ─────────────────────────────────────
+_profiler: Optional[cProfile.Profile] = None
+
+
+def profiling() -> bool:
+    return _profiler is not None
+
+
+def start_profiler() -> None:
+    """cProfile the calling thread (the bot loop when toggled over HTTP)."""
+    global _profiler
+    if _profiler is None:
+        _profiler = cProfile.Profile(); _profiler.enable()
+
+
+def stop_profiler(limit: int = 40) -> str:
+    """Stop profiling; returns the top <limit> functions by cumulative time."""
+    global _profiler
+    if _profiler is None: return "profiler is not running\n"
+    prof, _profiler = _profiler, None
+    prof.disable()
+    out = io.StringIO()
+    pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+# ───────────────────────── HTTP endpoint ────────────────────────────────
+async def serve(host: str, port: int, profile: bool = False):
+    """Serve /metrics (Prometheus), /metrics.json and, if <profile>,
+    /profile/start and /profile/stop on the running loop; returns the runner."""
+    from aiohttp import web
+
+    async def prom(_):     return web.Response(text=registry.prometheus(),
+                                               content_type="text/plain", charset="utf-8")
+    async def as_json(_):  return web.json_response(registry.snapshot())
+    async def p_start(_):  start_profiler(); return web.Response(text="profiling\n")
+    async def p_stop(req): return web.Response(text=stop_profiler(int(req.query.get("limit", 40))))
+
+    app = web.Application()
+    app.router.add_get("/metrics", prom)
+    app.router.add_get("/metrics.json", as_json)
+    if profile:
+        app.router.add_post("/profile/start", p_start)
+        app.router.add_post("/profile/stop", p_stop)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,103 @@
+# snapshot.py — on-disk session state so a restarted bot only reconciles the delta
+
+import sqlite3, threading, time
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+CHECKPOINT_EVERY = 500                  # journal rows folded into the snapshot at once
+
+
+class SessionRow(NamedTuple):
+    sid:       str
+    shard:     int                      # sessions channel id of the owning shard
+    msg_id:    Optional[int]            # counter message
+    ch_id:     Optional[int]            # session text channel
+    count:     int
+    last_seen: float                    # unix time of the last payload
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (sid TEXT PRIMARY KEY, shard INTEGER, msg_id INTEGER,
+                                     ch_id INTEGER, count INTEGER, last_seen REAL);
+CREATE TABLE IF NOT EXISTS journal  (seq INTEGER PRIMARY KEY AUTOINCREMENT, sid TEXT,
+                                     shard INTEGER, msg_id INTEGER, ch_id INTEGER,
+                                     count INTEGER, last_seen REAL);
+CREATE TABLE IF NOT EXISTS marks    (shard INTEGER PRIMARY KEY, high_water INTEGER);
+CREATE TABLE IF NOT EXISTS meta     (key TEXT PRIMARY KEY, value REAL);
+"""
+
+
+class StateStore:
+    """SQLite snapshot of session rows plus an append-only journal of changes.
+
+    Writers only ever append to the journal (a NULL count marks a removal);
+    checkpoint() folds it into the snapshot table. Readers replay the journal
+    on top of the snapshot, so a crash between the two loses nothing.
+    """
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._pending = self._db.execute("SELECT COUNT(*) FROM journal").fetchone()[0]
+
+    def _replay(self) -> Dict[str, SessionRow]:
+        rows = {r[0]: SessionRow(*r) for r in self._db.execute(
+            "SELECT sid, shard, msg_id, ch_id, count, last_seen FROM sessions")}
+        for r in self._db.execute("SELECT sid, shard, msg_id, ch_id, count, last_seen "
+                                  "FROM journal ORDER BY seq"):
+            if r[4] is None: rows.pop(r[0], None)
+            else:            rows[r[0]] = SessionRow(*r)
+        return rows
+
+    def load(self) -> Tuple[Dict[str, SessionRow], Dict[int, int], Optional[float]]:
+        """(rows by sid, high-water mark by shard, time of the last write)."""
+        with self._lock:
+            rows  = self._replay()
+            marks = dict(self._db.execute("SELECT shard, high_water FROM marks"))
+            saved = self._db.execute("SELECT value FROM meta WHERE key = 'saved_at'").fetchone()
+        return rows, marks, saved[0] if saved else None
+
+    def append(self, rows: Iterable[SessionRow], gone: Iterable[str],
+               marks: Dict[int, int]) -> None:
+        """Journal upserted <rows> and removed sids, and record <marks>, atomically."""
+        entries = [tuple(r) for r in rows] + [(sid, None, None, None, None, None) for sid in gone]
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany("INSERT INTO journal (sid, shard, msg_id, ch_id, count, "
+                                     "last_seen) VALUES (?, ?, ?, ?, ?, ?)", entries)
+                self._db.executemany("INSERT OR REPLACE INTO marks VALUES (?, ?)", marks.items())
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('saved_at', ?)", (time.time(),))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK"); raise
+            self._pending += len(entries)
+            if self._pending >= CHECKPOINT_EVERY: self._checkpoint()
+
+    def _checkpoint(self) -> None:
+        rows = self._replay()
+        self._db.execute("BEGIN")
+        try:
+            self._db.execute("DELETE FROM sessions")
+            self._db.executemany("INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+                                 [tuple(r) for r in rows.values()])
+            self._db.execute("DELETE FROM journal")
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK"); raise
+        self._pending = 0
+
+    def checkpoint(self) -> None:
+        """Fold the journal into the snapshot table."""
+        with self._lock: self._checkpoint()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.executescript("DELETE FROM sessions; DELETE FROM journal; "
+                                   "DELETE FROM marks; DELETE FROM meta;")
+            self._pending = 0
+
+    def close(self) -> None:
+        with self._lock: self._db.close()